@@ -0,0 +1,287 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from bitmap import ACCIDENT_BITMAPS, PERSON_BITMAPS, build_bitmaps, select
+from cube import ACCIDENT_DIMENSIONS, PERSON_DIMENSIONS
+from dataset import accidents_dir, read_dataset
+from kpi import DISTRICT_COUNTS, INTRO_COUNTS, INTRO_DISTINCT, summarize
+from schema import (AGE_BINS, AGE_LABELS, FATAL_PREFIX, LABELS, SEVERITY, UNKNOWN_AGES, apply_schema, convert_schema,
+                    label_column)
+
+try:
+    import duckdb
+except ImportError:
+    # dependencia opcional: solo hace falta para el backend "duckdb"
+    duckdb = None
+
+# Backend de las consultas de agregación de las páginas: recuentos por grupos, valores distintos y los
+# valores más frecuentes. Cada consulta se escribe una vez y se ejecuta con:
+#   - "pandas": sobre las tablas ya cargadas en memoria (filtros con los bitmaps de bitmap.py)
+#   - "duckdb": SQL sobre el conjunto Parquet de la ingesta, sin cargarlo en memoria
+# Los resultados tienen los mismos tipos en los dos backends (ver check_parity)
+
+BACKENDS = ["pandas", "duckdb"]
+
+# Tipos de las columnas derivadas (ver schema.py) en los resultados de DuckDB
+DERIVED_DTYPES = {label_column(column): pd.CategoricalDtype(list(dict.fromkeys(mapping.values())))
+                  for column, mapping in LABELS.items()}
+DERIVED_DTYPES["Gravedad"] = pd.CategoricalDtype(list(SEVERITY.values()), ordered=True)
+DERIVED_DTYPES["Franja_Edad"] = pd.CategoricalDtype(AGE_LABELS, ordered=True)
+
+
+def connect_pandas(tables, bitmaps=None):
+    # tables: {tabla: DataFrame}; bitmaps: {tabla: índice de bitmap.py} para resolver los filtros
+    return {"backend": "pandas", "tables": tables, "bitmaps": bitmaps or {}}
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _case(column, mapping):
+    # CASE con la traducción de una columna (valores que no están en "mapping" -> NULL)
+    whens = " ".join(f"WHEN {_quote(key)} THEN {_quote(value)}" for key, value in mapping.items())
+    return f'CASE "{column}" {whens} END'
+
+
+def _person_views(path):
+    # Vistas con las mismas columnas que la tabla de personas en memoria (edad entera y columnas derivadas)
+    unknown = ", ".join(_quote(value) for value in UNKNOWN_AGES)
+    labels = ", ".join(f"{_case(column, mapping)} AS {label_column(column)}" for column, mapping in LABELS.items())
+    bands = " ".join(f"WHEN Edat > {low} AND Edat <= {high} THEN {_quote(label)}"
+                     for low, high, label in zip(AGE_BINS[:-1], AGE_BINS[1:], AGE_LABELS))
+    # misma gravedad que schema.add_severity: cualquier victimización que empieza por "Mort" es mortal
+    severity = f"""CASE WHEN starts_with("Descripcio_victimitzacio", {_quote(FATAL_PREFIX)}) THEN 'Mortal'
+                   ELSE {_case(label_column("Descripcio_victimitzacio"), SEVERITY)} END"""
+    return [
+        f"""CREATE VIEW personas_base AS
+            SELECT * REPLACE (CASE WHEN trim(Edat) IN ({unknown}) THEN NULL
+                              ELSE TRY_CAST(trim(Edat) AS SMALLINT) END AS Edat), {labels}
+            FROM read_parquet({_quote(path)}, hive_partitioning = true)""",
+        f"""CREATE VIEW personas AS
+            SELECT *, {severity} AS Gravedad, coalesce({severity} = 'Mortal', false) AS Muerto,
+                   CASE {bands} END AS Franja_Edad
+            FROM personas_base""",
+    ]
+
+
+def connect_duckdb(dataset_dir):
+    # Base de datos DuckDB en memoria con una vista por tabla sobre el conjunto Parquet
+    if duckdb is None:
+        raise RuntimeError("El backend duckdb necesita el paquete duckdb (pip install duckdb)")
+    con = duckdb.connect()
+    for sql in _person_views(os.path.join(dataset_dir, "NK_Any=*", "*.parquet")):
+        con.execute(sql)
+    path = os.path.join(accidents_dir(dataset_dir), "NK_Any=*", "*.parquet")
+    con.execute(f"""CREATE VIEW accidentes AS
+                    SELECT *, Muertos > 0 AS Muerto FROM read_parquet({_quote(path)}, hive_partitioning = true)""")
+    return {"backend": "duckdb", "con": con}
+
+
+def connect(backend, dataset_dir=None, tables=None, bitmaps=None):
+    if backend == "duckdb":
+        return connect_duckdb(dataset_dir)
+    return connect_pandas(tables, bitmaps)
+
+
+def _values(values):
+    if not isinstance(values, (list, tuple, set)):
+        values = [values]
+    # los escalares de numpy (np.int16...) como valores de Python para DuckDB
+    return [value.item() if isinstance(value, np.generic) else value for value in values]
+
+
+def _filter(conn, table, where):
+    # filas de la tabla que cumplen "where" ({columna: valor o lista de valores})
+    data = conn["tables"][table]
+    if not where:
+        return data
+    index = conn["bitmaps"].get(table)
+    if index is not None and set(where) <= set(index["bitmaps"]):
+        return data[select(index, where)]
+    mask = np.ones(len(data), dtype=bool)
+    for column, values in where.items():
+        mask &= data[column].isin(_values(values)).to_numpy()
+    return data[mask]
+
+
+def _where_sql(where, not_null=()):
+    # cláusula WHERE con parámetros y, opcionalmente, sin nulos en las columnas "not_null"
+    conditions, params = [], []
+    for column, values in (where or {}).items():
+        values = _values(values)
+        if values:
+            conditions.append(f'"{column}" IN ({", ".join("?" * len(values))})')
+            params.extend(values)
+        else:
+            conditions.append("false")
+    conditions += [f'"{column}" IS NOT NULL' for column in not_null]
+    return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+
+def _query(conn, sql, params):
+    # un cursor por consulta: la conexión se comparte entre las sesiones de Streamlit
+    return conn["con"].cursor().execute(sql, params)
+
+
+def _typed(result):
+    # mismos tipos que las columnas en memoria: esquema compacto y categorías de las columnas derivadas
+    result = convert_schema(result)
+    for column, dtype in DERIVED_DTYPES.items():
+        if column in result.columns:
+            result[column] = result[column].astype(dtype)
+    return result
+
+
+def _counts_series(result, column):
+    # resultado (columna, "count") -> Series como los recuentos de kpi.py
+    values = result[column]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.astype(values.cat.categories.dtype)
+    return pd.Series(result["count"].to_numpy(), index=pd.Index(values, name=column), name="count")
+
+
+def group_counts(conn, table, by, where=None, dropna=True):
+    # Recuento de filas por cada combinación de "by" tras filtrar por "where". Devuelve un DataFrame con
+    # las columnas de "by" y "count", ordenado por "by". Como en groupby, con dropna se descartan los nulos
+    by = list(by)
+    if conn["backend"] == "pandas":
+        data = _filter(conn, table, where)
+        return data.groupby(by, observed=True, dropna=dropna).size().rename("count").reset_index()
+
+    columns = ", ".join(f'"{column}"' for column in by)
+    clause, params = _where_sql(where, by if dropna else ())
+    result = _query(conn, f'SELECT {columns}, count(*) AS "count" FROM {table}{clause} GROUP BY ALL', params).df()
+    result = _typed(result)
+    return result.sort_values(by, na_position="last", kind="stable", ignore_index=True)
+
+
+def summary(conn, table, where=None, distinct=(), counts=()):
+    # Métricas de la selección con la misma forma que kpi.summarize: filas, valores distintos y no nulos
+    # de "distinct" y recuento por valor de "counts"
+    if conn["backend"] == "pandas":
+        return summarize(_filter(conn, table, where), distinct=distinct, counts=counts)
+
+    clause, params = _where_sql(where)
+    aggregates = ["count(*)"]
+    for column in distinct:
+        aggregates += [f'count(DISTINCT "{column}")', f'count("{column}")']
+    row = _query(conn, f"SELECT {', '.join(aggregates)} FROM {table}{clause}", params).fetchone()
+
+    result = {"rows": int(row[0]), "distinct": {}, "count": {}, "counts": {}}
+    for i, column in enumerate(distinct):
+        result["distinct"][column], result["count"][column] = int(row[1 + 2 * i]), int(row[2 + 2 * i])
+    for column in counts:
+        result["counts"][column] = _counts_series(group_counts(conn, table, [column], where), column)
+    return result
+
+
+def top(conn, table, column, where=None, n=1):
+    # Los "n" valores más frecuentes de una columna en la selección (Series valor -> "count", de más a
+    # menos; en los empates, primero el valor menor)
+    if conn["backend"] == "pandas":
+        return summarize(_filter(conn, table, where), counts=[column])["counts"][column].nlargest(n)
+
+    clause, params = _where_sql(where, [column])
+    result = _query(conn, f'SELECT "{column}", count(*) AS "count" FROM {table}{clause} GROUP BY ALL '
+                          f'ORDER BY "count" DESC, "{column}" LIMIT {int(n)}', params).df()
+    return _counts_series(_typed(result), column)
+
+
+# Consultas de las páginas que se comparan entre backends: (nombre, función, argumentos)
+PARITY_QUERIES = [
+    ("cubo de personas", group_counts, {"table": "personas", "by": PERSON_DIMENSIONS, "dropna": False}),
+    ("cubo de accidentes", group_counts, {"table": "accidentes", "by": ACCIDENT_DIMENSIONS, "dropna": False}),
+    ("vehículos de fallecidos", group_counts, {"table": "personas", "by": ["NK_Any", "Desc_Tipus_vehicle_implicat"],
+                                               "where": {"Gravedad": "Mortal"}}),
+    ("edad por año", group_counts, {"table": "personas", "by": ["NK_Any", "Edat"]}),
+    ("métricas de introducción", summary, {"table": "personas", "distinct": INTRO_DISTINCT, "counts": INTRO_COUNTS}),
+    ("métricas de distritos", summary, {"table": "accidentes", "where": {"Muerto": True}, "counts": DISTRICT_COUNTS}),
+    ("calles con más accidentes", top, {"table": "accidentes", "column": "Nom_carrer", "n": 5}),
+]
+
+
+def _normalize(result):
+    # resultado comparable entre backends: textos y recuentos enteros, en un orden fijo
+    if isinstance(result, dict):
+        counts = {column: _normalize(values) for column, values in result["counts"].items()}
+        return {**result, "counts": counts}
+    if isinstance(result, pd.Series):
+        result = result.reset_index()
+    result = result.copy()
+    for column in result.columns:
+        if column == "count":
+            result[column] = result[column].astype("int64")
+        else:
+            result[column] = result[column].astype("string").fillna("<NA>")
+    return result.sort_values(list(result.columns), ignore_index=True)
+
+
+def _equal(left, right):
+    if isinstance(left, dict):
+        return left.keys() == right.keys() and all(_equal(left[key], right[key]) for key in left)
+    if isinstance(left, pd.DataFrame):
+        return left.equals(right)
+    return left == right
+
+
+def _timed(function, repeat):
+    # resultado y mejor tiempo (ms) de "repeat" ejecuciones
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def load_pandas(dataset_dir):
+    # Las tablas y los bitmaps en memoria, como los carga la aplicación a partir del conjunto Parquet
+    people = apply_schema(read_dataset(dataset_dir))
+    accidents = apply_schema(read_dataset(accidents_dir(dataset_dir)))
+    return connect_pandas({"personas": people, "accidentes": accidents},
+                          {"personas": build_bitmaps(people, PERSON_BITMAPS),
+                           "accidentes": build_bitmaps(accidents, ACCIDENT_BITMAPS)})
+
+
+def check_parity(dataset_dir, repeat=3):
+    # Ejecutar PARITY_QUERIES con los dos backends. Devuelve un DataFrame con el tiempo de cada backend
+    # (ms, el mejor de "repeat") y si los resultados coinciden
+    conns = {}
+    times = {}
+    conns["pandas"], times["pandas"] = _timed(lambda: load_pandas(dataset_dir), 1)
+    conns["duckdb"], times["duckdb"] = _timed(lambda: connect_duckdb(dataset_dir), 1)
+    rows = [{"consulta": "carga", "pandas_ms": times["pandas"], "duckdb_ms": times["duckdb"], "iguales": True}]
+
+    for name, function, kwargs in PARITY_QUERIES:
+        results = {}
+        for backend, conn in conns.items():
+            results[backend], times[backend] = _timed(lambda: function(conn, **kwargs), repeat)
+        rows.append({"consulta": name, "pandas_ms": times["pandas"], "duckdb_ms": times["duckdb"],
+                     "iguales": _equal(_normalize(results["pandas"]), _normalize(results["duckdb"]))})
+
+    report = pd.DataFrame(rows).set_index("consulta")
+    return report.round({"pandas_ms": 1, "duckdb_ms": 1})
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Comparar los resultados y los tiempos de los backends de consultas")
+    parser.add_argument("dataset", nargs="?", default=os.path.join(here, "..", "data", "datos_combinados"),
+                        help="conjunto Parquet generado por ingest.py")
+    parser.add_argument("--repeat", type=int, default=3, help="ejecuciones de cada consulta (se toma la mejor)")
+    args = parser.parse_args()
+
+    report = check_parity(args.dataset, args.repeat)
+    print(report.to_string())
+    if not report["iguales"].all():
+        raise SystemExit("Los backends no devuelven los mismos resultados")
+
+
+if __name__ == "__main__":
+    main()
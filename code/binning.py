@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+# Histogramas calculados en el servidor: se cuentan las filas de cada intervalo con bincount sobre
+# columnas enteras y el gráfico solo recibe un total por intervalo (y por grupo), no las filas
+
+
+def _bin_index(values, start, width, bins):
+    index = (values - start) // width
+    return index, (index >= 0) & (index < bins)
+
+
+def _bins(start, width, bins):
+    # intervalos [start, end) y su punto medio para valores enteros (con width=1, el propio valor)
+    edges = start + width * np.arange(bins)
+    return {"start": edges, "end": edges + width, "x": edges + (width - 1) / 2}
+
+
+def histogram(series, start=0, stop=None, width=1):
+    # Recuento por intervalos de "width" desde "start" hasta "stop" (por defecto, el valor máximo).
+    # Devuelve un DataFrame con "start", "end", "x" (centro del intervalo) y "count"
+    values = series.dropna().to_numpy(dtype=np.int64)
+    if stop is None:
+        stop = int(values.max()) + 1 if len(values) else start + width
+    bins = -(-(stop - start) // width)
+
+    index, valid = _bin_index(values, start, width, bins)
+    counts = np.bincount(index[valid], minlength=bins)
+    return pd.DataFrame({**_bins(start, width, bins), "count": counts})
+
+
+def histogram_by(data, column, by, start=0, stop=None, width=1):
+    # Como histogram, pero con un histograma por cada valor de "by" (facetas), en una sola pasada:
+    # cada fila suma en la posición grupo * intervalos + intervalo
+    data = data.dropna(subset=[column, by])
+    values = data[column].to_numpy(dtype=np.int64)
+    if stop is None:
+        stop = int(values.max()) + 1 if len(values) else start + width
+    bins = -(-(stop - start) // width)
+
+    groups, group_values = pd.factorize(data[by], sort=True)
+    index, valid = _bin_index(values, start, width, bins)
+    counts = np.bincount(groups[valid] * bins + index[valid], minlength=len(group_values) * bins)
+
+    result = pd.DataFrame({key: np.tile(value, len(group_values)) for key, value in _bins(start, width, bins).items()})
+    result.insert(0, by, np.repeat(np.asarray(group_values), bins))
+    result["count"] = counts
+    return result
+
+
+def merge_histograms(histograms, by=None, keys=()):
+    # Unir los histogramas (mismo inicio y anchura) de selecciones disjuntas, por ejemplo uno por año.
+    # Sin "by" se suman los recuentos de cada intervalo; con "by" se devuelven en formato largo como
+    # histogram_by: un histograma por cada valor de "keys" con datos, todos con los mismos intervalos
+    edges = ["start", "end", "x"]
+    if not histograms:
+        return pd.DataFrame(columns=([by] if by else []) + edges + ["count"])
+    bins = pd.concat(histograms, ignore_index=True).groupby(edges, as_index=False)["count"].sum()
+    if by is None:
+        return bins
+
+    parts = []
+    for key, part in zip(keys, histograms):
+        if part["count"].sum() == 0:
+            continue
+        part = bins[edges].merge(part, how="left", on=edges)
+        part["count"] = part["count"].fillna(0).astype("int64")
+        part.insert(0, by, key)
+        parts.append(part)
+    return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+# Índices de bitmaps para las dimensiones de los filtros de la barra lateral.
+# Para cada dimensión y valor se guarda un bit por fila (empaquetado, 8 filas por byte). Una combinación
+# de filtros se resuelve con OR entre los valores de una dimensión y AND entre dimensiones, y solo al
+# final se obtiene la máscara de filas
+
+# Dimensiones indexadas de la tabla de personas
+PERSON_BITMAPS = [
+    "NK_Any",
+    "Mes_any",
+    "Desc_Tipus_vehicle_implicat",
+    "Nom_districte",
+    "Descripcio_tipus_persona_es",
+    "Gravedad",
+]
+
+# Dimensiones indexadas de la tabla de accidentes ("Muerto": accidentes con algún fallecido)
+ACCIDENT_BITMAPS = [
+    "NK_Any",
+    "Mes_any",
+    "Nom_districte",
+    "Muerto",
+]
+
+
+def _codes(series):
+    # códigos enteros y valores de una columna (las categorías ya los tienen, los nulos quedan como -1)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), list(series.cat.categories)
+    codes, values = pd.factorize(series, sort=True)
+    return codes, list(values)
+
+
+def build_bitmaps(data, dimensions):
+    # Construir el índice: {"rows": filas, "bitmaps": {dimensión: {valor: bitmap}}}
+    index = {"rows": len(data), "bitmaps": {}}
+    for column in dimensions:
+        codes, values = _codes(data[column])
+        index["bitmaps"][column] = {value: np.packbits(codes == code) for code, value in enumerate(values)}
+    return index
+
+
+def index_values(index, column):
+    # valores de una dimensión indexada (para las opciones de los filtros)
+    return sorted(index["bitmaps"][column])
+
+
+def select(index, where):
+    # Máscara de las filas que cumplen "where" ({dimensión: valor o lista de valores})
+    size = (index["rows"] + 7) // 8
+    result = np.full(size, 0xFF, dtype=np.uint8)
+    for column, values in where.items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        bitmaps = index["bitmaps"][column]
+        union = np.zeros(size, dtype=np.uint8)
+        for value in values:
+            if value in bitmaps:
+                np.bitwise_or(union, bitmaps[value], out=union)
+        np.bitwise_and(result, union, out=result)
+    return np.unpackbits(result, count=index["rows"]).astype(bool)
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+
+# Tablas cruzadas de dos dimensiones codificadas como enteros (día de la semana 0-6, mes 1-12,
+# hora 0-23...). Cada fila suma en la celda fila * columnas + columna con un solo bincount y el
+# resultado es una matriz densa de recuentos; las etiquetas solo se añaden al representarla
+
+WEEKDAYS = ["Dilluns", "Dimarts", "Dimecres", "Dijous", "Divendres", "Dissabte", "Diumenge"]
+MONTHS = ["Gener", "Febrer", "Març", "Abril", "Maig", "Juny", "Juliol", "Agost", "Setembre", "Octubre", "Novembre",
+          "Desembre"]
+
+# Dimensiones con códigos fijos: valores (enteros consecutivos o textos en su orden) y etiquetas.
+# El resto de columnas se codifican con sus valores presentes, ordenados
+DIMENSIONS = {
+    "Hora_dia": {"values": list(range(24))},
+    "Dia_mes": {"values": list(range(1, 32))},
+    "Mes_any": {"values": list(range(1, 13)), "labels": MONTHS},
+    "Descripcio_dia_setmana": {"values": WEEKDAYS},
+}
+
+
+def encode(series):
+    # Códigos enteros de una columna (-1 para los nulos y los valores fuera de la dimensión) y sus valores
+    dimension = DIMENSIONS.get(series.name)
+    if dimension is None:
+        codes, values = pd.factorize(series, sort=True)
+        return codes, list(values)
+
+    values = dimension["values"]
+    if isinstance(values[0], str):
+        # textos: posición en la lista de valores (sobre una categoría solo se recodifican las categorías)
+        return pd.Categorical(series, categories=values).codes.astype(np.int64), values
+
+    numbers = pd.to_numeric(series).to_numpy(dtype=np.float64, na_value=np.nan) - values[0]
+    valid = (numbers >= 0) & (numbers < len(values))
+    return np.where(valid, numbers, -1).astype(np.int64), values
+
+
+def crosstab(data, rows, columns, weights=None):
+    # Recuentos (o suma de "weights", por ejemplo la medida de un cuboide) por cada combinación de
+    # "rows" y "columns": {"rows", "columns", "row_values", "column_values", "matrix"}
+    row_codes, row_values = encode(data[rows])
+    column_codes, column_values = encode(data[columns])
+    valid = (row_codes >= 0) & (column_codes >= 0)
+
+    cells = row_codes[valid] * len(column_values) + column_codes[valid]
+    counts = np.bincount(cells, weights=data[weights].to_numpy()[valid] if weights else None,
+                         minlength=len(row_values) * len(column_values))
+    return {"rows": rows, "columns": columns, "row_values": row_values, "column_values": column_values,
+            "matrix": counts.astype(np.int64).reshape(len(row_values), len(column_values))}
+
+
+def labels(table, axis):
+    # etiquetas de las filas ("rows") o columnas ("columns") de la tabla
+    dimension = DIMENSIONS.get(table[axis], {})
+    return dimension.get("labels", table["row_values" if axis == "rows" else "column_values"])
+
+
+def to_long(table, row_name=None, column_name=None):
+    # Celdas con recuento en formato largo (etiqueta de la fila, etiqueta de la columna y "count"),
+    # en el orden de los códigos
+    rows, columns = np.nonzero(table["matrix"])
+    return pd.DataFrame({
+        row_name or table["rows"]: np.asarray(labels(table, "rows"), dtype=object)[rows],
+        column_name or table["columns"]: np.asarray(labels(table, "columns"), dtype=object)[columns],
+        "count": table["matrix"][rows, columns],
+    })
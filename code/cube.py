@@ -0,0 +1,105 @@
+import pandas as pd
+
+# Cubo de agregados precalculados al cargar los datos.
+# Se guarda el recuento de filas de cada combinación de dimensiones (cuboide base) y, además,
+# los cuboides más pequeños que consultan las páginas. Una consulta usa el cuboide más pequeño que
+# contiene sus dimensiones, así que su coste depende del número de combinaciones y no de las filas
+
+# Dimensiones del cubo de personas implicadas
+PERSON_DIMENSIONS = [
+    "NK_Any",
+    "Mes_any",
+    "Descripcio_dia_setmana",
+    "Hora_dia",
+    "Nom_districte",
+    "Nom_barri",
+    "Desc_Tipus_vehicle_implicat",
+    "Descripcio_sexe_es",
+    "Franja_Edad",
+    "Descripcio_tipus_persona_es",
+    "Descripcio_victimitzacio_es",
+    "Muerto",
+]
+
+# Cuboides que consultan las páginas de personas (año, categoría y marca de fallecido)
+PERSON_CUBOIDS = [
+    ["NK_Any", "Descripcio_sexe_es", "Muerto"],
+    ["NK_Any", "Franja_Edad", "Muerto"],
+    ["NK_Any", "Descripcio_tipus_persona_es", "Muerto"],
+    ["NK_Any", "Descripcio_victimitzacio_es", "Muerto"],
+    ["NK_Any", "Desc_Tipus_vehicle_implicat", "Muerto"],
+]
+
+# Dimensiones del cubo de accidentes (una fila por expediente, "Muerto" si hay algún fallecido)
+ACCIDENT_DIMENSIONS = [
+    "NK_Any",
+    "Mes_any",
+    "Nom_mes",
+    "Dia_mes",
+    "Descripcio_dia_setmana",
+    "Descripcio_torn",
+    "Hora_dia",
+    "Nom_districte",
+    "Nom_barri",
+    "Muerto",
+]
+
+# Cuboides que consultan las páginas de accidentes (momento del accidente, distritos y barrios)
+ACCIDENT_CUBOIDS = [
+    ["NK_Any", "Mes_any", "Hora_dia", "Descripcio_dia_setmana"],
+    ["NK_Any", "Nom_districte", "Nom_barri", "Muerto"],
+]
+
+
+def _aggregate(table, by, measure, dropna=False):
+    if not by:
+        return pd.DataFrame({measure: [table[measure].sum()]})
+    return table.groupby(by, observed=True, dropna=dropna)[measure].sum().reset_index()
+
+
+def build_cube(data, dimensions, measure="Total", cuboids=()):
+    # Construir el cubo: el cuboide base (todas las dimensiones) se calcula sobre las filas y el resto
+    # a partir del cuboide base. Las combinaciones con nulos se conservan para que los totales cuadren
+    base = data.groupby(list(dimensions), observed=True, dropna=False).size().rename(measure).reset_index()
+    return cube_from_base(base, dimensions, measure, cuboids)
+
+
+def cube_from_base(base, dimensions, measure="Total", cuboids=()):
+    # Construir el cubo a partir del cuboide base ya agregado (por ejemplo, por el backend de consultas)
+    cube = {"measure": measure, "dimensions": list(dimensions), "cuboids": {tuple(dimensions): base}}
+    for dims in cuboids:
+        cube["cuboids"][tuple(dims)] = _aggregate(base, list(dims), measure)
+    return cube
+
+
+def _find_cuboid(cube, dims):
+    # el cuboide más pequeño que contiene todas las dimensiones pedidas
+    candidates = [table for key, table in cube["cuboids"].items() if set(dims) <= set(key)]
+    if not candidates:
+        raise KeyError(f"El cubo no tiene las dimensiones {sorted(set(dims) - set(cube['dimensions']))}")
+    return min(candidates, key=len)
+
+
+def slice_cube(cube, where=None, dims=()):
+    # Corte del cubo: filas del cuboide más pequeño con las dimensiones de "where" y "dims",
+    # filtradas por "where" ({dimensión: valor o lista de valores})
+    where = where or {}
+    table = _find_cuboid(cube, list(where) + list(dims))
+    for column, values in where.items():
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        table = table[table[column].isin(values)]
+    return table
+
+
+def rollup(cube, by, where=None, dropna=True):
+    # Agregar el cubo por las dimensiones "by" tras filtrar por "where". Devuelve un DataFrame con
+    # las dimensiones y la medida. Como en groupby, por defecto se descartan los grupos con nulos
+    by = list(by)
+    table = slice_cube(cube, where, by)
+    return _aggregate(table, by, cube["measure"], dropna=dropna)
+
+
+def total(cube, where=None):
+    # Total de la medida tras filtrar por "where"
+    return int(slice_cube(cube, where)[cube["measure"]].sum())
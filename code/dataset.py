@@ -0,0 +1,164 @@
+import hashlib
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from pandas.api.types import union_categoricals
+
+from schema import apply_schema, is_fatal
+
+
+# Tabla de accidentes (una fila por "Numero_expedient"): momento, lugar y coordenadas del accidente.
+# La tabla de personas la referencia por "Numero_expedient"
+ACCIDENT_COLUMNS = [
+    "NK_Any",
+    "Codi_districte",
+    "Nom_districte",
+    "Codi_barri",
+    "Nom_barri",
+    "Codi_carrer",
+    "Nom_carrer",
+    "Num_postal",
+    "Descripcio_dia_setmana",
+    "Dia_setmana",
+    "Descripcio_tipus_dia",
+    "Mes_any",
+    "Nom_mes",
+    "Dia_mes",
+    "Descripcio_torn",
+    "Hora_dia",
+    "Coordenada_UTM_X",
+    "Coordenada_UTM_Y",
+    "Longitud",
+    "Latitud",
+]
+
+# Carpeta de la tabla de accidentes dentro del conjunto de datos
+# (pyarrow no la lee con las personas por empezar por "_")
+ACCIDENTS_DIR = "_accidentes"
+
+
+def accidents_dir(dataset_dir):
+    return os.path.join(dataset_dir, ACCIDENTS_DIR)
+
+
+def accidents_snapshot_path(snapshot_path):
+    # "datos_combinados.arrow" -> "datos_combinados_accidentes.arrow"
+    return os.path.splitext(snapshot_path)[0] + "_accidentes.arrow"
+
+
+def build_accidents(data):
+    # Construir la tabla de accidentes a partir de las personas implicadas, con el número de
+    # personas y de muertos de cada accidente
+    dead = is_fatal(data["Descripcio_victimitzacio"])
+    grouped = data.assign(Muertos=dead).groupby("Numero_expedient", observed=True)
+
+    accidents = grouped[ACCIDENT_COLUMNS].first()
+    accidents["Personas"] = grouped.size().astype("int16")
+    accidents["Muertos"] = grouped["Muertos"].sum().astype("int16")
+
+    return accidents.reset_index()
+
+
+def read_dataset(dataset_dir, columns=None, years=None):
+    # Leer el conjunto de datos particionado por año ("NK_Any=2018/part-0.parquet", ...)
+    filters = [("NK_Any", "in", list(years))] if years is not None else None
+    data = pd.read_parquet(dataset_dir, columns=columns, filters=filters)
+
+    # la partición se recupera como categoría, volvemos a dejar el año como entero
+    if "NK_Any" in data.columns:
+        data["NK_Any"] = data["NK_Any"].astype("int64")
+
+    return data
+
+
+def dataset_exists(dataset_dir):
+    return os.path.isdir(dataset_dir)
+
+
+def write_snapshot(data, snapshot_path):
+    # Guardar una instantánea Arrow IPC (Feather v2) sin compresión y en un único bloque por columna,
+    # así se puede abrir con memory mapping sin copiar ni concatenar las columnas
+    tmp_path = snapshot_path + ".tmp"
+    feather.write_feather(data, tmp_path, compression="uncompressed", chunksize=max(len(data), 1))
+    # reemplazo atómico: los procesos que ya tienen abierta la instantánea anterior la siguen viendo entera
+    os.replace(tmp_path, snapshot_path)
+
+
+def read_snapshot(snapshot_path):
+    # Abrir la instantánea en solo lectura por memory mapping. Las columnas numéricas y los códigos
+    # de las categorías apuntan a las páginas del fichero, que el sistema operativo comparte
+    # entre todos los procesos de Streamlit que la abren
+    source = pa.memory_map(snapshot_path, "r")
+    table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas(split_blocks=True, self_destruct=False)
+
+
+def snapshot_exists(snapshot_path):
+    return os.path.isfile(snapshot_path)
+
+
+def _source_files(path):
+    # ficheros que forman una fuente de datos (un fichero suelto o las particiones de una carpeta)
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    return [path]
+
+
+def data_version(path, content_hash=False):
+    # Versión de una fuente de datos a partir de la fecha de modificación y el tamaño de sus ficheros
+    # (opcionalmente también del contenido). Cambia cuando se regenera la fuente y sirve como clave de caché
+    version = hashlib.sha1()
+    for file_path in _source_files(path):
+        stat = os.stat(file_path)
+        version.update(f"{os.path.relpath(file_path, path)}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+        if content_hash:
+            with open(file_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    version.update(block)
+    return version.hexdigest()[:16]
+
+
+def read_csv_streaming(path, chunksize=50000, max_memory=None, progress=None, delimiter=";"):
+    # Leer un csv grande por bloques de "chunksize" filas, aplicando el esquema compacto a cada bloque.
+    # Solo se mantiene en memoria un bloque de texto a la vez más los bloques ya convertidos, y al unirlos
+    # solo se duplica una columna a la vez.
+    #   max_memory: techo de memoria en bytes (bloques convertidos + bloque actual), si se supera se aborta
+    #   progress: función progress(fraccion_leida, filas_leidas) para informar del avance
+    total_size = os.path.getsize(path)
+    chunks = []
+    loaded = 0
+    rows = 0
+
+    with open(path, "rb") as f:
+        for chunk in pd.read_csv(f, encoding="utf8", delimiter=delimiter, chunksize=chunksize):
+            raw_size = chunk.memory_usage(index=False, deep=True).sum()
+            chunk = apply_schema(chunk)
+            loaded += chunk.memory_usage(index=False, deep=True).sum()
+            rows += len(chunk)
+
+            if max_memory is not None and loaded + raw_size > max_memory:
+                raise MemoryError(f"Se ha superado el límite de memoria ({max_memory} bytes) "
+                                  f"tras leer {rows} filas de {path}")
+
+            # cada columna en su propio array, para poder liberarla al unir los bloques
+            chunks.append({column: chunk[column].copy() for column in chunk.columns})
+            del chunk
+            if progress is not None:
+                progress(min(f.tell() / total_size, 1.0), rows)
+
+    if not chunks:
+        return apply_schema(pd.read_csv(path, encoding="utf8", delimiter=delimiter))
+
+    # unir los bloques columna a columna: las categorías de cada bloque son distintas y se unifican. Cada
+    # columna se saca de los bloques al unirla, así que la memoria no llega a duplicarse
+    data = {}
+    for column in list(chunks[0]):
+        parts = [chunk.pop(column) for chunk in chunks]
+        if isinstance(parts[0].dtype, pd.CategoricalDtype):
+            data[column] = pd.Series(union_categoricals(parts))
+        else:
+            data[column] = pd.concat(parts, ignore_index=True)
+        del parts
+    return pd.DataFrame(data, copy=False)
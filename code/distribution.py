@@ -0,0 +1,30 @@
+from cube import rollup
+
+# Reparto de una dimensión por año (sexo, franja de edad, tipo de persona, victimización...).
+# Se hace una sola consulta al cubo y de la tabla año x categoría salen el donut (total de cada
+# categoría), el orden de las categorías, los porcentajes y las líneas de evolución por año
+
+
+def distribution(cube, dimension, where=None, dropna=False):
+    # Devuelve un diccionario con:
+    #   table: tabla año x categoría con los recuentos
+    #   year_totals: total de cada año (incluye las filas con la dimensión nula, salvo con dropna=True)
+    #   totals: total de cada categoría con datos, de más a menos (orden de los gráficos)
+    measure = cube["measure"]
+    counts = rollup(cube, ["NK_Any", dimension], where, dropna=dropna)
+    year_totals = counts.groupby("NK_Any")[measure].sum()
+
+    table = counts.dropna(subset=[dimension]).pivot_table(index="NK_Any", columns=dimension, values=measure,
+                                                          aggfunc="sum", fill_value=0, observed=True)
+    totals = table.sum().sort_values(ascending=False, kind="stable")
+
+    return {"dimension": dimension, "table": table, "year_totals": year_totals, "totals": totals[totals > 0]}
+
+
+def trend(dist, percentage=False):
+    # Evolución por año y categoría en formato largo (columnas "NK_Any", dimensión y "Total"), solo con
+    # las combinaciones que tienen datos. En porcentaje, sobre el total de cada año
+    table = dist["table"]
+    values = table.div(dist["year_totals"], axis=0) * 100 if percentage else table
+    observed = table.stack() > 0
+    return values.stack()[observed].rename("Total").reset_index()
@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from mapgrid import to_meters
+
+# Dimensión geográfica de distritos y barrios: códigos, nombres, centroide y rectángulo de cada uno.
+# Se genera en la ingesta a partir de la tabla de accidentes (todos los años) y los mapas de la página de
+# distritos la unen con los recuentos del cubo. El centroide es robusto: solo cuentan las coordenadas
+# dentro de Barcelona y, de cada zona, se descartan los puntos demasiado lejos de la mediana
+
+# Niveles de la dimensión: nombre -> columnas que identifican cada zona
+LEVELS = {
+    "Nom_districte": ["Codi_districte", "Nom_districte"],
+    "Nom_barri": ["Codi_districte", "Nom_districte", "Codi_barri", "Nom_barri"],
+}
+
+# Rectángulo de Barcelona (lat_min, lat_max, lon_min, lon_max): fuera de él las coordenadas son erróneas
+BARCELONA_BOUNDS = (41.30, 41.48, 2.05, 2.25)
+
+# Un punto es atípico si su distancia a la mediana de la zona supera la mediana de las distancias en más
+# de OUTLIER_MADS desviaciones absolutas medianas
+OUTLIER_MADS = 3.0
+
+# Carpeta de la dimensión dentro del conjunto de datos (un fichero por nivel)
+GEO_DIR = "_geo"
+
+
+def geo_dir(dataset_dir):
+    return os.path.join(dataset_dir, GEO_DIR)
+
+
+def geo_path(dataset_dir, level):
+    return os.path.join(geo_dir(dataset_dir), f"{level}.parquet")
+
+
+def _level(points, keys):
+    grouped = points.groupby(keys, observed=True, sort=True)
+    x, y = to_meters(points["Latitud"], points["Longitud"])
+    x_median, y_median = to_meters(grouped["Latitud"].transform("median"), grouped["Longitud"].transform("median"))
+    distance = pd.Series(np.hypot(x - x_median, y - y_median), index=points.index)
+
+    by_zone = distance.groupby([points[key] for key in keys], observed=True)
+    median = by_zone.transform("median")
+    mad = (distance - median).abs().groupby([points[key] for key in keys], observed=True).transform("median")
+    kept = points[distance <= median + OUTLIER_MADS * mad]
+
+    geo = kept.groupby(keys, observed=True, sort=True).agg(
+        Latitud=("Latitud", "mean"), Longitud=("Longitud", "mean"),
+        Lat_min=("Latitud", "min"), Lat_max=("Latitud", "max"),
+        Lon_min=("Longitud", "min"), Lon_max=("Longitud", "max"),
+        Puntos=("Latitud", "size"))
+    return geo.reset_index()
+
+
+def build_geo(accidents):
+    # Dimensión geográfica de una tabla de accidentes: {nivel: DataFrame con las columnas del nivel,
+    # "Latitud" y "Longitud" (centroide), "Lat_min", "Lat_max", "Lon_min", "Lon_max" y "Puntos"}
+    lat_min, lat_max, lon_min, lon_max = BARCELONA_BOUNDS
+    columns = sorted({key for keys in LEVELS.values() for key in keys}) + ["Latitud", "Longitud"]
+    points = accidents[columns].astype({"Latitud": np.float64, "Longitud": np.float64})
+    # zonas conocidas (los desconocidos tienen código -1) con coordenadas dentro de Barcelona
+    valid = (points["Codi_districte"] >= 0) & (points["Codi_barri"] >= 0) & \
+        points["Latitud"].between(lat_min, lat_max) & points["Longitud"].between(lon_min, lon_max)
+    points = points[valid.fillna(False).astype(bool)]
+    points = points.astype({key: str for key in ["Nom_districte", "Nom_barri"]})
+    return {level: _level(points, keys) for level, keys in LEVELS.items()}
+
+
+def write_geo(geo, dataset_dir):
+    os.makedirs(geo_dir(dataset_dir), exist_ok=True)
+    for level, table in geo.items():
+        # reemplazo atómico, como las instantáneas: la aplicación nunca lee un fichero a medio escribir
+        path = geo_path(dataset_dir, level)
+        table.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+
+def read_geo(dataset_dir):
+    # Dimensión geográfica guardada por la ingesta, o None si falta algún nivel
+    if not all(os.path.isfile(geo_path(dataset_dir, level)) for level in LEVELS):
+        return None
+    return {level: pd.read_parquet(geo_path(dataset_dir, level)) for level in LEVELS}
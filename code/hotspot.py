@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+from mapgrid import cell_keys, to_degrees, to_meters
+
+# Puntos negros: agrupaciones de accidentes parecidas a DBSCAN pero en tiempo lineal gracias a una rejilla.
+# Los accidentes se reparten en celdas cuadradas de EPS metros; una celda es densa si tiene al menos
+# MIN_POINTS accidentes y cada punto negro es una componente conexa de celdas densas vecinas (también en
+# diagonal). Las filas de las celdas densas son las del punto negro y su contorno es la envolvente convexa
+# de las celdas
+
+EPS = 50.0
+MIN_POINTS = 8
+
+# desplazamientos de las celdas vecinas (la mitad: cada par de vecinas se mira una sola vez)
+NEIGHBOURS = [(1, -1), (1, 0), (1, 1), (0, 1)]
+
+
+def _components(ix, iy):
+    # Componente conexa (0, 1, ...) de cada celda, propagando la etiqueta mínima entre vecinas
+    keys = cell_keys(ix, iy)
+    order = np.argsort(keys)
+    sorted_keys = keys[order]
+    first, second = [], []
+    for dx, dy in NEIGHBOURS:
+        wanted = cell_keys(ix + dx, iy + dy)
+        found = np.minimum(np.searchsorted(sorted_keys, wanted), len(keys) - 1)
+        exists = sorted_keys[found] == wanted
+        first.append(np.flatnonzero(exists))
+        second.append(order[found[exists]])
+    first, second = np.concatenate(first), np.concatenate(second)
+
+    labels = np.arange(len(keys))
+    while True:
+        lowest = np.minimum(labels[first], labels[second])
+        updated = labels.copy()
+        np.minimum.at(updated, first, lowest)
+        np.minimum.at(updated, second, lowest)
+        updated = updated[updated]
+        if np.array_equal(updated, labels):
+            return pd.factorize(labels)[0]
+        labels = updated
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def convex_hull(x, y):
+    # Envolvente convexa (cadena monótona de Andrew) en sentido antihorario, sin repetir el primer vértice
+    points = sorted(set(zip(x.tolist(), y.tolist())))
+    if len(points) <= 2:
+        return points
+
+    def half(points):
+        hull = []
+        for point in points:
+            while len(hull) >= 2 and _cross(hull[-2], hull[-1], point) <= 0:
+                hull.pop()
+            hull.append(point)
+        return hull
+
+    return half(points)[:-1] + half(points[::-1])[:-1]
+
+
+def hotspots(lat, lon, mask=None, groups=None, eps=EPS, min_points=MIN_POINTS):
+    # Puntos negros de las filas seleccionadas por "mask". Con "groups" (por ejemplo el código del expediente)
+    # cada grupo cuenta como un solo accidente. Devuelve (puntos negros, filas, punto negro de cada fila):
+    # DataFrame con "Punto_negro" (1 el de más accidentes), "Latitud" y "Longitud" (centroide), "Accidentes",
+    # "Filas" y "Contorno" (vértices [longitud, latitud] del polígono cerrado)
+    rows = np.arange(len(lat)) if mask is None else np.flatnonzero(mask)
+    x, y = to_meters(lat[rows], lon[rows])
+    valid = np.isfinite(x) & np.isfinite(y)
+    rows, x, y = rows[valid], x[valid], y[valid]
+    ix, iy = np.floor(x / eps).astype(np.int64), np.floor(y / eps).astype(np.int64)
+    keys = cell_keys(ix, iy)
+
+    # un punto por accidente: la primera de sus filas
+    points = np.arange(len(rows))
+    if groups is not None:
+        _, points = np.unique(groups[rows], return_index=True)
+        points.sort()
+
+    cells, first, counts = np.unique(keys[points], return_index=True, return_counts=True)
+    dense = counts >= min_points
+    dense_keys = cells[dense]
+    cell_ix, cell_iy = ix[points[first[dense]]], iy[points[first[dense]]]
+    components = _components(cell_ix, cell_iy) if len(dense_keys) else np.empty(0, dtype=np.int64)
+
+    # punto negro de cada fila (-1 fuera de las celdas densas)
+    found = np.minimum(np.searchsorted(dense_keys, keys), max(len(dense_keys) - 1, 0))
+    labels = np.full(len(rows), -1, dtype=np.int64)
+    if len(dense_keys):
+        inside = dense_keys[found] == keys
+        labels[inside] = components[found[inside]]
+
+    n = len(np.unique(components))
+    point_labels = labels[points]
+    clustered = point_labels >= 0
+    accidents = np.bincount(point_labels[clustered], minlength=n)
+    point_lat = np.asarray(lat, dtype=np.float64)[rows[points]][clustered]
+    point_lon = np.asarray(lon, dtype=np.float64)[rows[points]][clustered]
+
+    outlines = []
+    for cluster in range(n):
+        # esquinas de las celdas del punto negro
+        corner_x = (cell_ix[components == cluster][:, None] + np.array([0, 1, 0, 1])).ravel() * eps
+        corner_y = (cell_iy[components == cluster][:, None] + np.array([0, 0, 1, 1])).ravel() * eps
+        hull = convex_hull(corner_x, corner_y)
+        hull_lat, hull_lon = to_degrees([p[0] for p in hull], [p[1] for p in hull])
+        outline = [[float(lon_), float(lat_)] for lat_, lon_ in zip(hull_lat, hull_lon)]
+        outlines.append(outline + outline[:1])
+
+    result = pd.DataFrame({
+        "Latitud": np.bincount(point_labels[clustered], weights=point_lat, minlength=n) / np.maximum(accidents, 1),
+        "Longitud": np.bincount(point_labels[clustered], weights=point_lon, minlength=n) / np.maximum(accidents, 1),
+        "Accidentes": accidents,
+        "Filas": np.bincount(labels[labels >= 0], minlength=n),
+        "Contorno": pd.Series(outlines, dtype=object),
+    })
+
+    # numerar de más a menos accidentes
+    order = np.argsort(-accidents, kind="stable")
+    renumber = np.empty(n, dtype=np.int64)
+    renumber[order] = np.arange(n)
+    labels[labels >= 0] = renumber[labels[labels >= 0]]
+    result = result.iloc[order].reset_index(drop=True)
+    result.insert(0, "Punto_negro", np.arange(1, n + 1))
+    return result, rows, labels
+
+
+def to_geojson(clusters):
+    # Polígonos de los puntos negros como FeatureCollection (para una capa geojson del mapa)
+    return {"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"Punto_negro": int(cluster), "Accidentes": int(accidents)},
+         "geometry": {"type": "Polygon", "coordinates": [outline]}}
+        for cluster, accidents, outline in zip(clusters["Punto_negro"], clusters["Accidentes"], clusters["Contorno"])]}
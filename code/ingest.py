@@ -0,0 +1,385 @@
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from dataset import (accidents_dir, accidents_snapshot_path, build_accidents, read_dataset, read_snapshot,
+                     snapshot_exists, write_snapshot)
+from geodim import build_geo, write_geo
+from ranking import build_rankings, ranking_path, write_rankings
+from schema import SCHEMA, apply_schema
+from sketch import (HLL_PRECISION, SKETCH_MODE, SKETCH_MODES, build_sketches, read_sketch_settings, sketch_path,
+                    write_sketches)
+
+# Columnas del conjunto de datos combinado, con los nombres que esperan las páginas
+COLUMNS = [
+    "Numero_expedient",
+    "Codi_districte",
+    "Nom_districte",
+    "Codi_barri",
+    "Nom_barri",
+    "Codi_carrer",
+    "Nom_carrer",
+    "Num_postal",
+    "Descripcio_dia_setmana",
+    "Dia_setmana",
+    "Descripcio_tipus_dia",
+    "NK_Any",
+    "Mes_any",
+    "Nom_mes",
+    "Dia_mes",
+    "Descripcio_torn",
+    "Hora_dia",
+    "Descripcio_causa_vianant",
+    "Desc_Tipus_vehicle_implicat",
+    "Descripcio_sexe",
+    "Edat",
+    "Descripcio_tipus_persona",
+    "Descripcio_situacio",
+    "Descripcio_victimitzacio",
+    "Coordenada_UTM_X",
+    "Coordenada_UTM_Y",
+    "Longitud",
+    "Latitud",
+]
+
+# Cabeceras de los ficheros anuales de Open Data BCN que no coinciden con el nombre normalizado.
+# Las claves están en minúsculas, sin acentos y sin separadores (ver _header_key)
+COLUMN_ALIASES = {
+    "numerodexpedient": "Numero_expedient",
+    "nkbarri": "Codi_barri",
+    "numpostalcaption": "Num_postal",
+    "any": "NK_Any",
+    "mesdeany": "Mes_any",
+    "diademes": "Dia_mes",
+    "horadedia": "Hora_dia",
+    "coordenadautmxed50": "Coordenada_UTM_X",
+    "coordenadautmyed50": "Coordenada_UTM_Y",
+    "longitudwgs84": "Longitud",
+    "latitudwgs84": "Latitud",
+}
+
+# Columnas numéricas (el resto se guarda como texto, por ejemplo "Edat" puede valer "Desconegut")
+INTEGER_COLUMNS = ["Codi_districte", "Codi_barri", "Codi_carrer", "NK_Any", "Mes_any", "Dia_mes", "Hora_dia"]
+FLOAT_COLUMNS = ["Coordenada_UTM_X", "Coordenada_UTM_Y", "Longitud", "Latitud"]
+
+# Patrón de los ficheros anuales descargados de Open Data BCN
+RAW_PATTERN = "*_accidents_persones_gu_bcn*.csv"
+
+# Manifiesto de la ingesta dentro de la carpeta del conjunto de datos
+# (pyarrow ignora los ficheros que empiezan por "_")
+MANIFEST_NAME = "_manifest.json"
+
+
+def _header_key(name):
+    # quitar acentos, mayúsculas y cualquier separador: "Mes_ any" -> "mesany"
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+# índice clave normalizada -> nombre de columna
+_COLUMN_KEYS = {_header_key(column): column for column in COLUMNS}
+_COLUMN_KEYS.update(COLUMN_ALIASES)
+
+
+def normalize_columns(df):
+    # renombrar las cabeceras de un año al esquema común
+    df = df.rename(columns={column: _COLUMN_KEYS.get(_header_key(column), column) for column in df.columns})
+
+    # las columnas que no existen en ese año se añaden vacías y las desconocidas se descartan
+    for column in COLUMNS:
+        if column not in df.columns:
+            df[column] = pd.NA
+
+    return df[COLUMNS]
+
+
+def _detect_encoding(path):
+    # los ficheros más antiguos vienen en latin-1
+    try:
+        with open(path, encoding="utf-8-sig") as f:
+            f.read()
+        return "utf-8-sig"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+
+def _detect_delimiter(path, encoding):
+    with open(path, encoding=encoding) as f:
+        header = f.readline()
+    return ";" if header.count(";") > header.count(",") else ","
+
+
+def read_raw_year(path):
+    # Leer un fichero anual tal y como se publica en Open Data BCN
+    encoding = _detect_encoding(path)
+    delimiter = _detect_delimiter(path, encoding)
+
+    data = pd.read_csv(path, encoding=encoding, delimiter=delimiter, dtype=str, keep_default_na=False)
+    data = normalize_columns(data)
+
+    # quitar el relleno de espacios de campos como "Numero_expedient" o "Nom_carrer"
+    for column in COLUMNS:
+        data[column] = data[column].str.strip().replace("", pd.NA)
+
+    for column in INTEGER_COLUMNS:
+        data[column] = pd.to_numeric(data[column], errors="coerce").astype("Int64")
+    for column in FLOAT_COLUMNS:
+        # algunos años usan coma decimal
+        data[column] = pd.to_numeric(data[column].str.replace(",", ".", regex=False), errors="coerce")
+
+    # el año es la clave de partición, no puede faltar
+    data = data.dropna(subset=["NK_Any"])
+    data["NK_Any"] = data["NK_Any"].astype("int64")
+
+    return data
+
+
+def partition_path(dataset_dir, year):
+    return os.path.join(dataset_dir, f"NK_Any={year}", "part-0.parquet")
+
+
+def write_partition(data, dataset_dir, year):
+    # Escribir (o reemplazar) la partición de un año. La columna "NK_Any" va en la ruta (estilo hive)
+    path = partition_path(dataset_dir, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    data.drop(columns=["NK_Any"]).to_parquet(path, index=False)
+    return path
+
+
+def write_year(data, dataset_dir, year, sketch_mode=SKETCH_MODE):
+    # Escribir la partición de un año y todos los artefactos derivados que dependen solo de ese año
+    accidents = build_accidents(data)
+    write_partition(data, dataset_dir, year)
+    write_partition(accidents, accidents_dir(dataset_dir), year)
+    write_sketches(build_sketches(data, mode=sketch_mode), sketch_path(dataset_dir, year))
+    write_rankings(build_rankings(accidents), ranking_path(dataset_dir, year))
+
+
+def remove_year(dataset_dir, year):
+    for directory in [dataset_dir, accidents_dir(dataset_dir)]:
+        shutil.rmtree(os.path.dirname(partition_path(directory, year)), ignore_errors=True)
+    for path in [sketch_path(dataset_dir, year), ranking_path(dataset_dir, year)]:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def find_raw_files(raw_dir):
+    return sorted(glob.glob(os.path.join(raw_dir, RAW_PATTERN)))
+
+
+def file_checksum(path):
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+def read_manifest(dataset_dir):
+    # Manifiesto de la ingesta: checksum, filas y años de cada fichero anual ya incorporado
+    path = os.path.join(dataset_dir, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return {"files": {}}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(manifest, dataset_dir):
+    # Solo se reescribe si cambia: la fecha de modificación forma parte de la versión de los datos (data_version)
+    content = json.dumps(manifest, indent=2, sort_keys=True)
+    path = os.path.join(dataset_dir, MANIFEST_NAME)
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8") as f:
+            if f.read() == content:
+                return
+    os.makedirs(dataset_dir, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _read_raw_timed(path):
+    # se ejecuta en un proceso del pool: leer un fichero anual y medir cuánto tarda
+    start = time.perf_counter()
+    data = read_raw_year(path)
+    return data, time.perf_counter() - start
+
+
+def read_raw_files(paths, workers=None):
+    # Leer y normalizar varios ficheros anuales en paralelo (uno por proceso).
+    # Los resultados vuelven en el mismo orden que "paths", así que el orden de las filas es determinista
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        return [_read_raw_timed(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_read_raw_timed, paths))
+
+
+def update_dataset(raw_files, dataset_dir, rebuild=False, workers=None, sketch_mode=SKETCH_MODE):
+    # Incorporar al conjunto de datos particionado los ficheros anuales nuevos o modificados.
+    # Solo se vuelven a escribir los años de esos ficheros (los que tenían y los que tienen ahora), cada uno con
+    # las filas de todos los ficheros que lo contienen. Devuelve (años actualizados, manifiesto): el manifiesto
+    # no se guarda aquí, hay que guardarlo con write_manifest cuando las instantáneas ya estén al día
+    if rebuild:
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+    manifest = read_manifest(dataset_dir)
+    files = manifest["files"]
+    raw_paths = {os.path.basename(path): path for path in raw_files}
+    updated_years = set()
+
+    # ficheros que ya no están: hay que rehacer sus años con los demás ficheros
+    for name in sorted(set(files) - set(raw_paths)):
+        updated_years.update(files.pop(name)["years"])
+        print(f"{name}: eliminado")
+
+    # los sketches de todos los años tienen que ser del mismo modo para poder fusionarlos: si se pide otro
+    # modo, se rehacen todos los años
+    stored = {year for entry in files.values() for year in entry["years"]
+              if os.path.isfile(sketch_path(dataset_dir, year))
+              and read_sketch_settings(sketch_path(dataset_dir, year)) != (sketch_mode, HLL_PRECISION)}
+    if stored:
+        print(f"Sketches de otro modo en los años {sorted(stored)}: se regeneran todos los años en modo {sketch_mode}")
+        updated_years.update(year for entry in files.values() for year in entry["years"])
+
+    changed = []
+    for name, path in sorted(raw_paths.items()):
+        checksum = file_checksum(path)
+        if name in files and files[name]["sha256"] == checksum:
+            print(f"{name}: sin cambios")
+        else:
+            changed.append((name, path, checksum))
+
+    start = time.perf_counter()
+    loaded = {}
+    if changed:
+        results = read_raw_files([path for _, path, _ in changed], workers=workers)
+        for (name, path, checksum), (data, seconds) in zip(changed, results):
+            years = sorted(int(year) for year in data["NK_Any"].unique())
+            print(f"{name}: {len(data)} filas, años {years} ({seconds:.2f} s)")
+            previous = files.get(name)
+            updated_years.update(previous["years"] if previous else [])
+            updated_years.update(years)
+            files[name] = {"sha256": checksum, "rows": len(data), "years": years}
+            loaded[name] = data
+
+    # un año puede venir de varios ficheros: volver a leer los ficheros sin cambios que comparten algún año
+    shared = [name for name in sorted(files) if name not in loaded and updated_years & set(files[name]["years"])]
+    if shared:
+        results = read_raw_files([raw_paths[name] for name in shared], workers=workers)
+        for name, (data, seconds) in zip(shared, results):
+            print(f"{name}: releído para rehacer sus años ({seconds:.2f} s)")
+            loaded[name] = data
+
+    # unir en el orden de los ficheros y escribir cada año una sola vez; los años sin filas se quitan
+    written = set()
+    if loaded:
+        data = pd.concat([loaded[name] for name in sorted(loaded)], ignore_index=True)
+        for year, year_data in data[data["NK_Any"].isin(updated_years)].groupby("NK_Any", sort=True):
+            write_year(year_data, dataset_dir, year, sketch_mode)
+            written.add(int(year))
+    for year in updated_years - written:
+        remove_year(dataset_dir, year)
+    if changed:
+        print(f"Ingesta de {len(changed)} ficheros en {time.perf_counter() - start:.2f} s")
+
+    return sorted(updated_years), manifest
+
+
+def _merge_column(column, parts):
+    if not isinstance(parts[0].dtype, pd.CategoricalDtype):
+        return pd.concat(parts, ignore_index=True)
+    if SCHEMA.get(column) == "category":
+        # categorías inferidas de los valores: unión ordenada y sin las de los años quitados, como al leer todo
+        return pd.Series(union_categoricals(parts, sort_categories=True)).cat.remove_unused_categories()
+    # categorías fijas (columnas derivadas): son las mismas en todas las partes
+    return pd.Series(union_categoricals(parts))
+
+
+def merge_snapshot(previous, updated, years):
+    # Instantánea de todos los años a partir de la anterior (ya con el esquema aplicado) cambiando solo los
+    # años "years" por "updated", sin volver a leer ni convertir el resto. Las filas quedan en el orden de
+    # las particiones (por año), igual que al leer el conjunto completo
+    kept = previous[~previous["NK_Any"].isin(years)]
+    data = pd.DataFrame({column: _merge_column(column, [kept[column], updated[column]])
+                         for column in previous.columns}, copy=False)
+    return data.iloc[np.argsort(data["NK_Any"].to_numpy(), kind="stable")].reset_index(drop=True)
+
+
+def build_snapshot(dataset_dir, snapshot_path, years, rebuild=False):
+    # Instantánea actualizada de un conjunto particionado, sin guardarla. Si ya existe, solo se leen los años
+    # actualizados que siguen teniendo partición (los quitados solo desaparecen de la instantánea)
+    if not rebuild and snapshot_exists(snapshot_path):
+        previous = read_snapshot(snapshot_path)
+        if not years:
+            return previous
+        present = [year for year in years if os.path.isdir(os.path.dirname(partition_path(dataset_dir, year)))]
+        updated = apply_schema(read_dataset(dataset_dir, years=present)) if present else previous.iloc[:0]
+        if list(updated.columns) == list(previous.columns):
+            return merge_snapshot(previous, updated, years)
+    return apply_schema(read_dataset(dataset_dir))
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Generar el conjunto de datos combinado en Parquet")
+    parser.add_argument("--raw-dir", default=os.path.join(here, "..", "data"),
+                        help="carpeta con los csv anuales de Open Data BCN")
+    parser.add_argument("--output", default=os.path.join(here, "..", "data", "datos_combinados"),
+                        help="carpeta de salida del conjunto de datos particionado")
+    parser.add_argument("--snapshot", default=os.path.join(here, "..", "data", "datos_combinados.arrow"),
+                        help="instantánea Arrow que abre la aplicación por memory mapping")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="regenerar todos los años aunque no hayan cambiado")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="procesos para leer los ficheros anuales (por defecto, todos los núcleos)")
+    parser.add_argument("--sketch-mode", choices=SKETCH_MODES, default=SKETCH_MODE,
+                        help="sketches de valores distintos por año: exactos o HyperLogLog "
+                             "(al cambiarlo se regeneran todos los años)")
+    args = parser.parse_args()
+
+    raw_files = find_raw_files(args.raw_dir)
+    if not raw_files:
+        parser.error(f"No se han encontrado ficheros {RAW_PATTERN} en {args.raw_dir}")
+
+    updated_years, manifest = update_dataset(raw_files, args.output, rebuild=args.rebuild, workers=args.workers,
+                                             sketch_mode=args.sketch_mode)
+    if not updated_years and os.path.isfile(args.snapshot):
+        write_manifest(manifest, args.output)
+        print("Sin cambios")
+        return
+
+    # instantáneas con el esquema compacto ya aplicado, para compartirlas entre los procesos de la aplicación.
+    # Solo se leen y convierten los años actualizados; el resto se copia de la instantánea anterior
+    start = time.perf_counter()
+    accidents = build_snapshot(accidents_dir(args.output), accidents_snapshot_path(args.snapshot), updated_years,
+                               args.rebuild)
+
+    # la dimensión geográfica depende de todos los años (medianas por zona): se recalcula con la tabla de
+    # accidentes completa ya en memoria, una fila por expediente. Se guarda antes de reemplazar las
+    # instantáneas, así la aplicación nunca ve instantáneas nuevas con la dimensión anterior
+    geo_start = time.perf_counter()
+    write_geo(build_geo(accidents), args.output)
+    geo_seconds = time.perf_counter() - geo_start
+    print(f"Dimensión geográfica de {len(accidents)} accidentes en {geo_seconds:.2f} s")
+
+    write_snapshot(build_snapshot(args.output, args.snapshot, updated_years, args.rebuild), args.snapshot)
+    write_snapshot(accidents, accidents_snapshot_path(args.snapshot))
+    print(f"Instantáneas en {time.perf_counter() - start - geo_seconds:.2f} s")
+
+    # el manifiesto va al final: si algo falla antes, la siguiente ejecución vuelve a procesar los mismos años
+    write_manifest(manifest, args.output)
+    print(f"Años actualizados: {updated_years}. Instantánea: {args.snapshot}")
+
+
+if __name__ == "__main__":
+    main()
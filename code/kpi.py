@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+
+# Métricas resumen (KPI) de una selección de filas, calculadas recorriendo cada columna una sola vez.
+# En las columnas de categorías se cuentan los códigos con bincount en lugar de comparar textos
+
+# Métricas de la página de introducción (tabla de personas)
+INTRO_DISTINCT = ["Numero_expedient", "NK_Any", "Nom_districte", "Nom_barri", "Nom_carrer"]
+INTRO_COUNTS = ["Descripcio_victimitzacio_es"]
+
+# Métricas de la página de distritos y barrios (tabla de accidentes)
+DISTRICT_COUNTS = ["NK_Any", "Nom_carrer"]
+
+# Recuentos de la página del momento del accidente (tabla de accidentes)
+MOMENT_COUNTS = ["Descripcio_torn", "Descripcio_dia_setmana"]
+
+
+def _category_counts(series):
+    # recuento de cada categoría (los nulos tienen código -1 y no cuentan)
+    codes = series.cat.codes.to_numpy()
+    return np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+
+
+def _distinct(series):
+    # (valores distintos, valores no nulos)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        counts = _category_counts(series)
+        return int((counts > 0).sum()), int(counts.sum())
+    return int(series.nunique()), int(series.count())
+
+
+def _value_counts(series):
+    # recuento por valor, solo de los valores presentes y en el orden de las categorías (o de los valores)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        counts = pd.Series(_category_counts(series), index=series.cat.categories.rename(series.name), name="count")
+        return counts[counts > 0]
+    return series.value_counts(sort=False).sort_index()
+
+
+def summarize(data, distinct=(), counts=()):
+    # Resumen de una selección: {"rows": filas, "distinct": {columna: valores distintos},
+    # "count": {columna: valores no nulos}, "counts": {columna: recuento por valor}}
+    summary = {"rows": len(data), "distinct": {}, "count": {}, "counts": {}}
+    for column in distinct:
+        summary["distinct"][column], summary["count"][column] = _distinct(data[column])
+    for column in counts:
+        summary["counts"][column] = _value_counts(data[column])
+    return summary
+
+
+def merge_summaries(summaries, counts=()):
+    # Resumen de la unión de selecciones disjuntas (por ejemplo, un resumen por año): se suman las filas,
+    # los no nulos y los recuentos por valor de "counts". Los valores distintos no son aditivos y no se
+    # incluyen (ver sketch.py); el top-N sale de los recuentos sumados
+    merged = {"rows": sum(summary["rows"] for summary in summaries), "distinct": {}, "count": {}, "counts": {}}
+    for column in (summaries[0]["count"] if summaries else {}):
+        merged["count"][column] = sum(summary["count"][column] for summary in summaries)
+    for column in counts:
+        parts = [summary["counts"][column] for summary in summaries]
+        if parts:
+            merged["counts"][column] = pd.concat(parts).groupby(level=0, sort=True).sum()
+        else:
+            merged["counts"][column] = pd.Series([], index=pd.Index([], name=column), name="count", dtype="int64")
+    return merged
+
+
+def value_count(summary, column, value):
+    # recuento de un valor (0 si no aparece en la selección)
+    return int(summary["counts"][column].get(value, 0))
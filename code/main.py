@@ -1,4 +1,5 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import time
@@ -6,6 +7,25 @@ import threading
 import queue
 import base64
 
+from backend import connect, duckdb, group_counts, summary
+from binning import histogram, merge_histograms
+from bitmap import ACCIDENT_BITMAPS, PERSON_BITMAPS, build_bitmaps, index_values, select
+from cube import (ACCIDENT_CUBOIDS, ACCIDENT_DIMENSIONS, PERSON_CUBOIDS, PERSON_DIMENSIONS, cube_from_base, rollup,
+                  slice_cube, total)
+from crosstab import crosstab, labels, to_long
+from dataset import (ACCIDENTS_DIR, build_accidents, data_version, dataset_exists, read_csv_streaming, read_dataset,
+                     read_snapshot, snapshot_exists)
+from distribution import distribution, trend
+from geodim import BARCELONA_BOUNDS, build_geo, read_geo
+from hotspot import EPS, MIN_POINTS, hotspots, to_geojson
+from kpi import INTRO_COUNTS, INTRO_DISTINCT, MOMENT_COUNTS, merge_summaries, summarize, value_count
+from mapgrid import CENTER, ZOOM_LEVELS, aggregate, build_grid
+from raster import SEVERITY_COLORS, image_layer, raster_shape, rasterize, shade, to_data_uri
+from ranking import RANKINGS, build_rankings, rank_counts, read_year_rankings, top_n, year_totals
+from schema import add_derived_columns, apply_schema
+from spatial import VIEWPORT_MARGIN, VIEWPORT_PIXELS, build_index, nearest, radius, viewport, viewport_mask
+from sketch import build_sketches, distinct_count, merge_sketches, non_null_count, read_year_sketches
+
 # Configuración de la página
 st.set_page_config(
     page_title="PRA: Visualización de Datos (parte II)",
@@ -16,25 +36,376 @@ st.set_page_config(
 
 scale_color = px.colors.qualitative.Pastel
 
+# copy-on-write (ya es el comportamiento por defecto a partir de pandas 3): los DataFrames derivados
+# de los datos cacheados no comparten escrituras con ellos
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
 # change between online (streamlit) and local (locahost)
 online = True
 
-# @st.cache_data
-def load_data():
-    # Cargar datos desde el archivo CSV
+# lectura por bloques del csv combinado: filas por bloque y techo de memoria en MB (None = sin límite)
+csv_chunksize = 50000
+max_memory_mb = None
+
+# backend de las consultas de agregación (ver backend.py): "pandas" sobre los datos en memoria o
+# "duckdb" sobre el conjunto Parquet de la ingesta (si no está disponible se usa "pandas")
+query_backend = "pandas"
+
+def get_dataset_path():
+    # Conjunto Parquet generado por ingest.py
+    if online:
+        # online
+        return "./data/datos_combinados"
+    # local
+    return "../data/datos_combinados"
+
+
+def get_data_path():
+    # Fuente de los datos: instantánea Arrow o conjunto Parquet generados por ingest.py, o el csv combinado
     if online:
         # online
+        path_snapshot = "./data/datos_combinados.arrow"
         path_datos = "./data/datos_combinados.csv"
 
     else:
         # local
+        path_snapshot = "../data/datos_combinados.arrow"
         path_datos = "../data/datos_combinados.csv"
 
-    data = pd.read_csv(path_datos, encoding='utf8', delimiter=';')
-
+    path_dataset = get_dataset_path()
+    if snapshot_exists(path_snapshot):
+        return path_snapshot
+    if dataset_exists(path_dataset):
+        return path_dataset
+    return path_datos
+
+
+def get_data_version():
+    # Versión actual de los datos (fecha de modificación y tamaño de la fuente).
+    # Las cachés que dependen de los datos la usan como parte de su clave
+    return data_version(get_data_path())
+
+
+@st.cache_resource(max_entries=1)
+def load_data_version(path_datos, version):
+    # "version" solo forma parte de la clave: si cambia la fuente se vuelve a cargar y se descarta la anterior
+    if path_datos.endswith(".arrow"):
+        # memory mapping: sin copia y compartida entre procesos, ya tiene el esquema compacto
+        # (las columnas derivadas solo se añaden si la instantánea es anterior a ellas)
+        return add_derived_columns(read_snapshot(path_datos))
+
+    if dataset_exists(path_datos):
+        # tipos compactos: categorías, enteros pequeños, edad con nulos y float32
+        return apply_schema(read_dataset(path_datos))
+
+    # si todavía no se ha ejecutado la ingesta, leemos el csv combinado por bloques
+    # (cada bloque se convierte al esquema compacto según se lee)
+    progress_bar = st.progress(0.0, text="Cargando datos...")
+    data = read_csv_streaming(path_datos, chunksize=csv_chunksize,
+                              max_memory=max_memory_mb * 1024 * 1024 if max_memory_mb else None,
+                              progress=lambda fraction, rows: progress_bar.progress(
+                                  fraction, text=f"Cargando datos... {rows} filas"))
+    progress_bar.empty()
     return data
 
 
+def load_data():
+    # Todas las páginas y sesiones reciben el mismo DataFrame cacheado (sin copia por ejecución).
+    # No se debe modificar: con copy-on-write las columnas que añaden o cambian las páginas
+    # sobre los datos filtrados no afectan al DataFrame compartido
+    path_datos = get_data_path()
+    return load_data_version(path_datos, data_version(path_datos))
+
+
+@st.cache_resource(max_entries=1)
+def load_fatal_data_version(path_datos, version):
+    data = load_data_version(path_datos, version)
+    return data[data["Muerto"]]
+
+
+def load_fatal_data():
+    # Vista precalculada con solo las personas fallecidas ("Mostrar solo muertos", mapa de muertes)
+    path_datos = get_data_path()
+    return load_fatal_data_version(path_datos, data_version(path_datos))
+
+
+def get_accidents_path():
+    # Fuente de la tabla de accidentes generada por ingest.py (None si todavía no se ha generado)
+    if online:
+        # online
+        path_snapshot = "./data/datos_combinados_accidentes.arrow"
+        path_dataset = "./data/datos_combinados/" + ACCIDENTS_DIR
+
+    else:
+        # local
+        path_snapshot = "../data/datos_combinados_accidentes.arrow"
+        path_dataset = "../data/datos_combinados/" + ACCIDENTS_DIR
+
+    if snapshot_exists(path_snapshot):
+        return path_snapshot
+    if dataset_exists(path_dataset):
+        return path_dataset
+    return None
+
+
+@st.cache_resource(max_entries=1)
+def load_accidents_version(path_accidentes, version):
+    if path_accidentes is None:
+        # sin ingesta: la tabla se construye una sola vez a partir de las personas
+        return add_derived_columns(build_accidents(load_data()))
+    if path_accidentes.endswith(".arrow"):
+        return add_derived_columns(read_snapshot(path_accidentes))
+    return apply_schema(read_dataset(path_accidentes))
+
+
+def load_accidents():
+    # Tabla de accidentes: una fila por expediente (momento, lugar, coordenadas, personas y muertos).
+    # Las páginas que trabajan por accidente la usan en lugar de agrupar las personas por expediente
+    path_accidentes = get_accidents_path()
+    version = data_version(path_accidentes) if path_accidentes else get_data_version()
+    return load_accidents_version(path_accidentes, version)
+
+
+@st.cache_resource(max_entries=1)
+def load_backend_version(backend, path_dataset, version):
+    if backend == "duckdb" and duckdb is not None and dataset_exists(path_dataset):
+        return connect("duckdb", dataset_dir=path_dataset)
+    # pandas: las tablas y los bitmaps que ya tiene cargados la aplicación
+    return connect("pandas", tables={"personas": load_data(), "accidentes": load_accidents()},
+                   bitmaps={"personas": load_bitmaps(), "accidentes": load_accidents_bitmaps()})
+
+
+def load_backend():
+    # Conexión del backend de consultas elegido en "query_backend" (ver backend.py)
+    return load_backend_version(query_backend, get_dataset_path(), get_data_version())
+
+
+@st.cache_resource(max_entries=1)
+def load_cube_version(path_datos, version):
+    base = group_counts(load_backend(), "personas", PERSON_DIMENSIONS, dropna=False)
+    return cube_from_base(base.rename(columns={"count": "Personas"}), PERSON_DIMENSIONS, "Personas", PERSON_CUBOIDS)
+
+
+def load_cube():
+    # Cubo de recuentos de personas (ver cube.py). Las páginas lo consultan con rollup/total
+    # en lugar de agrupar las filas en cada interacción
+    path_datos = get_data_path()
+    return load_cube_version(path_datos, data_version(path_datos))
+
+
+@st.cache_resource(max_entries=1)
+def load_accidents_cube_version(path_accidentes, version):
+    base = group_counts(load_backend(), "accidentes", ACCIDENT_DIMENSIONS, dropna=False)
+    return cube_from_base(base.rename(columns={"count": "Accidentes"}), ACCIDENT_DIMENSIONS, "Accidentes",
+                          ACCIDENT_CUBOIDS)
+
+
+def load_accidents_cube():
+    # Cubo de recuentos de accidentes ("Muerto": accidentes con algún fallecido)
+    path_accidentes = get_accidents_path()
+    version = data_version(path_accidentes) if path_accidentes else get_data_version()
+    return load_accidents_cube_version(path_accidentes, version)
+
+
+@st.cache_resource(max_entries=1)
+def load_bitmaps_version(path_datos, version):
+    return build_bitmaps(load_data_version(path_datos, version), PERSON_BITMAPS)
+
+
+def load_bitmaps():
+    # Índice de bitmaps de las personas (ver bitmap.py): los filtros de la barra lateral se resuelven
+    # con select(bitmaps, where) en lugar de encadenar isin sobre las filas
+    path_datos = get_data_path()
+    return load_bitmaps_version(path_datos, data_version(path_datos))
+
+
+@st.cache_resource(max_entries=1)
+def load_grid_version(path_datos, version):
+    return build_grid(load_data_version(path_datos, version))
+
+
+def load_grid():
+    # Rejilla de las coordenadas de las personas a varios niveles de zoom (ver mapgrid.py)
+    path_datos = get_data_path()
+    return load_grid_version(path_datos, data_version(path_datos))
+
+
+@st.cache_resource(max_entries=1)
+def load_spatial_index_version(path_datos, version):
+    data = load_data_version(path_datos, version)
+    index = build_index(data)
+    # expediente de cada fila: el panel de inspección lista accidentes, no personas
+    index["groups"] = pd.factorize(data["Numero_expedient"])[0]
+    return index
+
+
+def load_spatial_index():
+    # Índice espacial de las coordenadas de las personas (ver spatial.py)
+    path_datos = get_data_path()
+    return load_spatial_index_version(path_datos, data_version(path_datos))
+
+
+@st.cache_data(max_entries=64)
+def load_hotspots_version(path_datos, version, years, vehicle_types, muertos, eps, min_points):
+    data = load_data_version(path_datos, version)
+    grid = load_grid_version(path_datos, version)
+    where = {"NK_Any": list(years), "Desc_Tipus_vehicle_implicat": list(vehicle_types)}
+    if muertos:
+        where["Gravedad"] = "Mortal"
+    mask = select(load_bitmaps_version(path_datos, version), where)
+
+    # cada expediente cuenta como un accidente
+    clusters, rows, labels = hotspots(grid["lat"], grid["lon"], mask, pd.factorize(data["Numero_expedient"])[0],
+                                      eps, min_points)
+
+    # calle con más filas de cada punto negro
+    streets = pd.DataFrame({"Punto_negro": labels + 1, "Nom_carrer": data["Nom_carrer"].to_numpy()[rows]})
+    streets = streets[labels >= 0].value_counts().reset_index().drop_duplicates("Punto_negro")
+    return clusters.merge(streets[["Punto_negro", "Nom_carrer"]], on="Punto_negro", how="left")
+
+
+def load_hotspots(years, vehicle_types, muertos, eps=EPS, min_points=MIN_POINTS):
+    # Puntos negros de los accidentes de la selección (ver hotspot.py), cacheados por filtros y versión de los datos
+    path_datos = get_data_path()
+    return load_hotspots_version(path_datos, data_version(path_datos), tuple(sorted(years)),
+                                 tuple(sorted(vehicle_types)), muertos, eps, min_points)
+
+
+@st.cache_resource(max_entries=1)
+def load_accidents_bitmaps_version(path_accidentes, version):
+    return build_bitmaps(load_accidents_version(path_accidentes, version), ACCIDENT_BITMAPS)
+
+
+def load_accidents_bitmaps():
+    # Índice de bitmaps de la tabla de accidentes
+    path_accidentes = get_accidents_path()
+    version = data_version(path_accidentes) if path_accidentes else get_data_version()
+    return load_accidents_bitmaps_version(path_accidentes, version)
+
+
+@st.cache_resource(max_entries=1)
+def load_sketches_version(path_dataset, version):
+    sketches = read_year_sketches(path_dataset) if dataset_exists(path_dataset) else {}
+    if not sketches:
+        # sin sketches de la ingesta: se construyen una sola vez a partir de los datos cargados
+        sketches = {int(year): build_sketches(year_data) for year, year_data in load_data().groupby("NK_Any")}
+    return sketches
+
+
+def load_sketches():
+    # Sketches de valores distintos de cada año (ver sketch.py)
+    return load_sketches_version(get_dataset_path(), get_data_version())
+
+
+@st.cache_data(max_entries=128)
+def load_year_summary_version(version, table, year, where, counts):
+    return summary(load_backend(), table, {"NK_Any": [year], **where}, counts=counts)
+
+
+def load_year_summaries(table, years, where=None, counts=()):
+    # Resumen de una selección de años como suma de los resúmenes de cada año (ver kpi.merge_summaries).
+    # Cada año se cachea por separado: al añadir o quitar un año solo se calcula ese año
+    version = get_data_version()
+    summaries = [load_year_summary_version(version, table, int(year), where or {}, tuple(counts)) for year in years]
+    return merge_summaries(summaries, counts)
+
+
+def load_intro_kpis(years):
+    # Métricas de la introducción: recuentos sumados por año y valores distintos de los sketches
+    kpis = load_year_summaries("personas", years, counts=INTRO_COUNTS)
+    # valores distintos y no nulos: fusión de los sketches de los años seleccionados, sin recorrer las filas
+    sketches = load_sketches()
+    merged = merge_sketches([sketches[year] for year in years if year in sketches])
+    kpis["distinct"] = {column: distinct_count(merged, column) for column in INTRO_DISTINCT}
+    kpis["count"] = {column: non_null_count(merged, column) for column in INTRO_DISTINCT}
+    return kpis
+
+
+@st.cache_resource(max_entries=1)
+def load_rankings_version(path_dataset, version):
+    rankings = read_year_rankings(path_dataset) if dataset_exists(path_dataset) else {}
+    if not rankings:
+        # sin índice de la ingesta: se construye una sola vez a partir de la tabla de accidentes
+        rankings = {int(year): build_rankings(year_data) for year, year_data in load_accidents().groupby("NK_Any")}
+    return rankings
+
+
+@st.cache_resource(max_entries=1)
+def load_geo_version(path_dataset, version):
+    geo = read_geo(path_dataset) if dataset_exists(path_dataset) else None
+    if geo is None:
+        # sin dimensión de la ingesta: se construye una sola vez a partir de la tabla de accidentes
+        geo = build_geo(load_accidents())
+    return geo
+
+
+def load_geo():
+    # Dimensión geográfica de distritos y barrios: códigos, nombres, centroides y rectángulos (ver geodim.py)
+    return load_geo_version(get_dataset_path(), get_data_version())
+
+
+def load_rankings():
+    # Índice de rankings de calles, distritos y barrios de cada año (ver ranking.py)
+    return load_rankings_version(get_dataset_path(), get_data_version())
+
+
+def load_top(name, years, muertos, n):
+    # Los n valores con más accidentes de un ranking en los años seleccionados. Si el índice no basta
+    # para asegurar el resultado, se cuentan los accidentes de la selección con el backend
+    years = [int(year) for year in years]
+    result = top_n(load_rankings(), name, years, n, fatal=muertos)
+    if result is None:
+        where = {"NK_Any": years}
+        if muertos:
+            where["Muerto"] = True
+        result = rank_counts(group_counts(load_backend(), "accidentes", RANKINGS[name], where), RANKINGS[name], n)
+    return result
+
+
+def load_year_totals(years, muertos):
+    # Accidentes de cada año seleccionado (Series año -> "count")
+    return year_totals(load_rankings(), [int(year) for year in years], fatal=muertos)
+
+
+@st.cache_data(max_entries=128)
+def load_age_histogram_version(path_datos, version, year, muertos):
+    where = {"NK_Any": [year]}
+    if muertos:
+        # filtrar los fallecidos (bitmap de la gravedad)
+        where["Gravedad"] = "Mortal"
+    data = load_data_version(path_datos, version)
+    ages = data.loc[select(load_bitmaps_version(path_datos, version), where), "Edat"]
+    return histogram(ages, width=5)
+
+
+def load_age_histograms(years, muertos):
+    # Histogramas de edad (intervalos de 5 años) de cada año, cacheados por año (ver binning.merge_histograms)
+    path_datos = get_data_path()
+    version = data_version(path_datos)
+    return [load_age_histogram_version(path_datos, version, int(year), muertos) for year in years]
+
+
+@st.cache_data(max_entries=128)
+def load_moment_partial_version(path_accidentes, version, year, months):
+    accidents = load_accidents_version(path_accidentes, version)
+    data = accidents.loc[select(load_accidents_bitmaps_version(path_accidentes, version),
+                                {"NK_Any": [year], "Mes_any": list(months)}),
+                         ["Hora_dia", "Dia_mes", "Descripcio_dia_setmana", "Descripcio_torn"]]
+    # las horas nulas y las de accidentes sin día de la semana no cuentan en el histograma
+    horas = data.loc[data["Descripcio_dia_setmana"].notnull(), "Hora_dia"]
+    return {"horas": histogram(horas, start=0, stop=24),
+            "dias": histogram(data["Dia_mes"], start=1, stop=32),
+            "kpis": summarize(data, counts=MOMENT_COUNTS)}
+
+
+def load_moment_partials(years, months):
+    # Recuentos de la página del momento del accidente de cada año, cacheados por año y meses
+    path_accidentes = get_accidents_path()
+    version = data_version(path_accidentes) if path_accidentes else get_data_version()
+    return [load_moment_partial_version(path_accidentes, version, int(year), tuple(months)) for year in years]
+
+
 def page_home():
     #st.title("Práctica Visualización de Datos (parte II)")
 
@@ -77,30 +448,29 @@ def page_intro():
     # saber el número de expedientes, personas implicadas, años diferentes,
     # número de distritos, número de barrios, número de calles
     data = load_data()
+    bitmaps = load_bitmaps()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data["NK_Any"].unique())
+    available_years = index_values(bitmaps, "NK_Any")
 
     # Checkbox para seleccionar los años
     selected_years = sorted(st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years))
 
-    # Filtrar los datos por los años seleccionados
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
-
-    filtered_data["NK_Any"] = filtered_data["NK_Any"].astype(str)
+    # Métricas de los años seleccionados (una pasada por columna, cacheadas por selección)
+    kpis = load_intro_kpis(selected_years)
 
     # get the total expedientes
-    total_expedientes = filtered_data["Numero_expedient"].nunique()
+    total_expedientes = kpis["distinct"]["Numero_expedient"]
     # get the total personas implicadas
-    total_personas_implicadas = filtered_data["Numero_expedient"].count()
+    total_personas_implicadas = kpis["count"]["Numero_expedient"]
     # get the total years
-    total_years = filtered_data["NK_Any"].nunique()
+    total_years = kpis["distinct"]["NK_Any"]
     # get the total distritos
-    total_distritos = filtered_data["Nom_districte"].nunique()
+    total_distritos = kpis["distinct"]["Nom_districte"]
     # get the total barrios
-    total_barrios = filtered_data["Nom_barri"].nunique()
+    total_barrios = kpis["distinct"]["Nom_barri"]
     # get the total calles
-    total_calles = filtered_data["Nom_carrer"].nunique()
+    total_calles = kpis["distinct"]["Nom_carrer"]
     # dividir en 6 columnas y mostrar los datos
     col1, col2, col3, col4, col5, col6 = st.columns(6)
     col1.metric(label="Años", value=total_years)
@@ -111,34 +481,19 @@ def page_intro():
     col6.metric(label="Calles", value=total_calles)
 
     # obtener numero de muertos, heridos graves, heridos leves, sanos, desconocidos
-    victimizacion_mapping = {
-        "Ferit lleu: Amb assistència sanitària en lloc d'accident": "Herido leve",
-        "Ferit lleu: Hospitalització fins a 24h": "Herido leve",
-        "Ferit lleu: Rebutja assistència sanitària": "Herido leve",
-        "Ferit greu: hospitalització superior a 24h": "Herido grave",
-        "Mort (dins 24h posteriors accident)": "Muerto",
-        "Mort (després de 24h posteriors accident)": "Muerto",
-        "Mort natural": "Muerto",
-        "Il.lès": "Sano",
-        "Desconegut": "Desconocido",
-        "Es desconeix": "Desconocido",
-    }
-
-    filtered_data["Descripcio_victimitzacio"] = filtered_data["Descripcio_victimitzacio"].map(victimizacion_mapping)
-    # contar cuantos muertos, heridos graves, heridos leves, sanos, desconocidos hay
-    cuantos_muertos = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Muerto"].count()
-    cuantos_heridos_graves = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Herido grave"].count()
-    cuantos_heridos_leves = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Herido leve"].count()
-    cuantos_sanos = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Sano"].count()
-    cuantos_desconocidos = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Desconocido"].count()
     # dividir en 6 columnas y mostrar los datos
     col1, col2, col3, col4, col5, col6 = st.columns(6)
     col1.metric(label="Personas Implicadas", value=total_personas_implicadas)
-    col2.metric(label="Muertos", value=cuantos_muertos["Descripcio_victimitzacio"])
-    col3.metric(label="Heridos Graves", value=cuantos_heridos_graves["Descripcio_victimitzacio"])
-    col4.metric(label="Heridos Leves", value=cuantos_heridos_leves["Descripcio_victimitzacio"])
-    col5.metric(label="Sanos", value=cuantos_sanos["Descripcio_victimitzacio"])
-    col6.metric(label="Desconocidos", value=cuantos_desconocidos["Descripcio_victimitzacio"])
+    col2.metric(label="Muertos", value=value_count(kpis, "Descripcio_victimitzacio_es", "Muerto"))
+    col3.metric(label="Heridos Graves", value=value_count(kpis, "Descripcio_victimitzacio_es", "Herido grave"))
+    col4.metric(label="Heridos Leves", value=value_count(kpis, "Descripcio_victimitzacio_es", "Herido leve"))
+    col5.metric(label="Sanos", value=value_count(kpis, "Descripcio_victimitzacio_es", "Sano"))
+    col6.metric(label="Desconocidos", value=value_count(kpis, "Descripcio_victimitzacio_es", "Desconocido"))
+
+    # primeras filas de los años seleccionados (sin filtrar todas las filas)
+    rows = np.flatnonzero(select(bitmaps, {"NK_Any": selected_years}))[:10]
+    filtered_data = data.iloc[rows]
+    filtered_data["NK_Any"] = filtered_data["NK_Any"].astype(str)
 
     # show head of the data
     # st.subheader("Primeras filas de los datos")
@@ -180,8 +535,9 @@ def create_pie_chart(data, años):
     fig = px.pie(
         data,
         names="Desc_Tipus_vehicle_implicat",
+        values="accident_count_yearly",
         title=f"Tipos de Vehículos Implicados en Accidentes ({años})",
-        labels={"Desc_Tipus_vehicle_implicat": "Tipo de Vehículo"},
+        labels={"Desc_Tipus_vehicle_implicat": "Tipo de Vehículo", "accident_count_yearly": "Número de Accidentes"},
         height=500,
         color_discrete_sequence=scale_color,
     )
@@ -195,53 +551,54 @@ def page_grafico_vehiculos():
     st.title("Accidentes por Tipos de Vehículos Implicados")
 
 
-    # Cargar datos
-    data = load_data()
+    # Cargar el cubo de recuentos
+    cube = load_cube()
+    years = rollup(cube, ["NK_Any"])["NK_Any"]
 
     # Slider de mínimo de accidentes
     selected_minAccidente = st.sidebar.slider("Seleccionar número mínimo de accidentes", min_value=1,
-                                              max_value=data.groupby("Desc_Tipus_vehicle_implicat")[
-                                                  "Desc_Tipus_vehicle_implicat"].transform("count").max(), value=2200)
+                                              max_value=rollup(cube, ["Desc_Tipus_vehicle_implicat"])[
+                                                  "Personas"].max(), value=2200)
     show_all_years = st.sidebar.checkbox("Mostrar todos los años", value=True)
     color = "NK_Any"
-    category_orders = {"NK_Any": sorted(data["NK_Any"].unique())}
+    category_orders = {"NK_Any": sorted(years.unique())}
 
-    años = f"{data['NK_Any'].min()}-{data['NK_Any'].max()}"
+    años = f"{years.min()}-{years.max()}"
 
+    where = {}
     if not show_all_years:
         selected_years = st.sidebar.select_slider("Seleccionar Rango de Años",
-                                                  options=list(range(data["NK_Any"].min(), data["NK_Any"].max() + 1)),
-                                                  value=(data["NK_Any"].min(), data["NK_Any"].max()))
-        data = data[data["NK_Any"].between(selected_years[0], selected_years[1])]
+                                                  options=list(range(years.min(), years.max() + 1)),
+                                                  value=(years.min(), years.max()))
+        where["NK_Any"] = list(range(selected_years[0], selected_years[1] + 1))
         if selected_years[0] == selected_years[1]:
             años = f"{selected_years[0]}"
         else:
             años = f"{selected_years[0]}-{selected_years[1]}"
 
-    # Agregar columna con el número de accidentes por categoría
-    data["accident_count"] = data.groupby("Desc_Tipus_vehicle_implicat")["Desc_Tipus_vehicle_implicat"].transform(
-        "count")
-
-    # Filtrar datos originales por el número mínimo de accidentes
-    filtered_data = data[data["accident_count"] >= selected_minAccidente]
+    # Número de accidentes por categoría en los años seleccionados
+    accident_count = rollup(cube, ["Desc_Tipus_vehicle_implicat"], where).set_index(
+        "Desc_Tipus_vehicle_implicat")["Personas"]
 
-    # Ordenar datos por el número de accidentes
-    filtered_data = filtered_data.sort_values(by=["NK_Any", "accident_count"], ascending=[True, True])
+    # Filtrar las categorías por el número mínimo de accidentes
+    where["Desc_Tipus_vehicle_implicat"] = list(accident_count[accident_count >= selected_minAccidente].index)
 
     # Poner un checkbox para mostrar los datos de sexo (muertos)
     if st.sidebar.checkbox("Mostrar solo muertos", value=False):
-        # filtrar los datos que contiene la palabra "Mort"
-        filtered_data = filtered_data[filtered_data["Descripcio_victimitzacio"].str.contains("Mort")]
-
+        # filtrar los fallecidos (marca precalculada)
+        where["Muerto"] = True
 
-    # Agregar columna con el número de accidentes por categoría y año
-    filtered_data["accident_count_yearly"] = filtered_data.groupby(["Desc_Tipus_vehicle_implicat", "NK_Any"])[
-        "Desc_Tipus_vehicle_implicat"].transform("count")
+    # Número de accidentes por categoría y año
+    unique_data = rollup(cube, ["Desc_Tipus_vehicle_implicat", "NK_Any"], where).rename(
+        columns={"Personas": "accident_count_yearly"})
 
+    # Ordenar datos por el número de accidentes
+    unique_data["accident_count"] = accident_count.reindex(unique_data["Desc_Tipus_vehicle_implicat"]).to_numpy()
+    unique_data = unique_data.sort_values(by=["NK_Any", "accident_count"], ascending=[True, True], kind="stable")
 
     # Capturar los 3 vehículos más implicados en accidentes
-    top_vehicles = filtered_data.groupby("Desc_Tipus_vehicle_implicat")["accident_count_yearly"].sum().sort_values(
-        ascending=False).head(5).index.tolist()
+    top_vehicles = unique_data.groupby("Desc_Tipus_vehicle_implicat", observed=True)[
+        "accident_count_yearly"].sum().sort_values(ascending=False).head(5).index.tolist()
     # obtener el texto de los 3 vehículos más implicados en accidentes
     top_vehicles = ", ".join(top_vehicles)
 
@@ -254,444 +611,114 @@ def page_grafico_vehiculos():
     """)
 
 
-    # Seleccionar columnas únicas
+    # Seleccionar columnas
     selected_columns = ["Desc_Tipus_vehicle_implicat", "NK_Any", "accident_count_yearly"]
-    unique_data = filtered_data[selected_columns].drop_duplicates()
+    unique_data = unique_data[selected_columns]
     unique_data["NK_Any"] = unique_data["NK_Any"].astype(str)
     unique_data["Desc_Tipus_vehicle_implicat"] = unique_data["Desc_Tipus_vehicle_implicat"].astype(str)
 
     # Crear y mostrar el gráfico de barras
     st.plotly_chart(create_bar_chart(unique_data, años), use_container_width=True)
 
-    # Crear y mostrar el gráfico de piechart
-    st.plotly_chart(create_pie_chart(filtered_data, años), use_container_width=True)
-
-
-def create_sex_pie_chart(filtered_data, selected_years, show_percentage):
-
-    # contar cuantos hombres, mujeres y desconocidos hay
-    cuantos_hombres = filtered_data[filtered_data["Descripcio_sexe"] == "Hombre"].count()
-    cuantos_mujeres = filtered_data[filtered_data["Descripcio_sexe"] == "Mujer"].count()
-    cuantos_desconocidos = filtered_data[filtered_data["Descripcio_sexe"] == "Desconocido"].count()
-    # hacer una array de las etiquetas y valores
-    labels = ["Hombre", "Mujer", "Desconocido"]
-    values = [cuantos_hombres["Descripcio_sexe"], cuantos_mujeres["Descripcio_sexe"], cuantos_desconocidos["Descripcio_sexe"]]
-    # construir un array de labels y values para poder ordernar por values
-    labels_values = []
-    for i in range(len(labels)):
-        labels_values.append([labels[i], values[i]])
-    # ordenar el array por values
-    labels_values.sort(key=lambda x: x[1], reverse=True)
-    category_order_pie_chart = []
-    # imprimir array labels_Values
-    for i in range(len(labels_values)):
-        category_order_pie_chart.append(labels_values[i][0])
-
-
-    # Crear gráfico de pie para mostrar la distribución porcentual de accidentes por sexo
-    fig = px.pie(
-        filtered_data,
-        names="Descripcio_sexe",
-        title=f"Distribución de Accidentes por Sexo ({'-'.join(map(str, selected_years))})",
-        labels={"Descripcio_sexe": "Sexo"},
-        height=500,
-        width=700,
-        hole=0.3,  # Agujero en el centro para hacerlo parecer un donut
-        color_discrete_sequence=scale_color
-    )
-
-    fig.update_traces(insidetextfont=dict(color='white', size=16),
-                      outsidetextfont=dict(color='gray', size=16))
-
-    # Añadir etiquetas con porcentajes
-    if show_percentage:
-        fig.update_traces(textinfo='percent+label', pull=[0.1, 0.1, 0.1])
-    else:
-        fig.update_traces(textinfo='value+label', pull=[0.1, 0.1, 0.1])
-
-    pie_chart_colors = scale_color[:3]
-    # category_order_pie_chart = ["Hombre", "Mujer", "Desconocido"]
+    # Crear y mostrar el gráfico de piechart (total de cada categoría, en el mismo orden que las barras)
+    totals = unique_data.groupby("Desc_Tipus_vehicle_implicat", sort=False)[
+        "accident_count_yearly"].sum().reset_index()
+    st.plotly_chart(create_pie_chart(totals, años), use_container_width=True)
 
-    return fig, pie_chart_colors, category_order_pie_chart
 
+# Gráficos de reparto por año: etiqueta de la dimensión, título del donut, título de la evolución
+# y título opcional de la leyenda
+DISTRIBUTIONS = {
+    "Descripcio_sexe_es": {"label": "Sexo", "title": "Sexo", "trend_title": "Sexo"},
+    "Franja_Edad": {"label": "Edad", "title": "Edad", "trend_title": "Franja de Edad", "legend": "Grupo de Edad"},
+    "Descripcio_tipus_persona_es": {"label": "Tipo de Persona", "title": "tipo de persona",
+                                    "trend_title": "tipo de persona"},
+    "Descripcio_victimitzacio_es": {"label": "Victimización", "title": "victimización",
+                                    "trend_title": "victimización"},
+}
 
-def create_age_pie_chart(filtered_data, selected_years, show_percentage):
 
+def create_distribution_pie_chart(dist, selected_years, show_percentage):
+    # Donut con el total de cada categoría (ver distribution.py), de más a menos
+    dimension = dist["dimension"]
+    config = DISTRIBUTIONS[dimension]
+    totals = dist["totals"].rename("Personas").reset_index()
 
-    # Crear gráfico de pie para mostrar la distribución porcentual de accidentes por sexo
+    # Crear gráfico de pie para mostrar la distribución porcentual de accidentes
     fig = px.pie(
-        filtered_data,
-        names="Franja_Edad",
-        title=f"Distribución de Accidentes por Edad ({'-'.join(map(str, selected_years))})",
-        labels={"Franja_Edad": "Edad"},
+        totals,
+        names=dimension,
+        values="Personas",
+        title=f"Distribución de Accidentes por {config['title']} ({'-'.join(map(str, selected_years))})",
+        labels={dimension: config["label"]},
         height=500,
         width=700,
         hole=0.3,  # Agujero en el centro para hacerlo parecer un donut
         color_discrete_sequence=scale_color
     )
-    # determine order to print the pie chart
-    order = filtered_data["Franja_Edad"].value_counts().index
 
     fig.update_traces(insidetextfont=dict(color='white', size=16),
                       outsidetextfont=dict(color='gray', size=16))
 
     # Añadir etiquetas con porcentajes
     if show_percentage:
-        fig.update_traces(textinfo='percent+label',
-                          pull=[0.1, 0.1, 0.1, 0.1])
+        fig.update_traces(textinfo='percent+label', pull=[0.1] * len(totals))
     else:
-        fig.update_traces(textinfo='value+label', pull=[0.1, 0.1, 0.1, 0.1])
-
-    # fig.layout.showlegend = False
-    fig.layout.legend.title = "Grupo de Edad"
+        fig.update_traces(textinfo='value+label', pull=[0.1] * len(totals))
 
-    pie_chart_colors = scale_color[:4]
-
-    return fig, pie_chart_colors, order
-
-
-def create_personas_pie_chart(data, selected_years, show_percentage):
-    # Filtrar los datos por los años seleccionados
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
-
-    # Calcular el número total de accidentes
-    total_accidents = len(filtered_data)
-
-    personas_mapping = {"Conductor": "Conductor", "Vianant": "Peatón", "Passatger": "Pasajero", "Desconegut": "Desconocido"}
-    filtered_data["Descripcio_tipus_persona"] = filtered_data["Descripcio_tipus_persona"].map(personas_mapping)
-
-    # saber cuantos registros hay de tipo conductor, pasajero, peaton, desconocido
-    cuantos_conductores = filtered_data[filtered_data["Descripcio_tipus_persona"] == "Conductor"].count()
-    cuantos_pasajeros = filtered_data[filtered_data["Descripcio_tipus_persona"] == "Pasajero"].count()
-    cuantos_peatones = filtered_data[filtered_data["Descripcio_tipus_persona"] == "Peatón"].count()
-    cuantos_desconocidos = filtered_data[filtered_data["Descripcio_tipus_persona"] == "Desconocido"].count()
-    # hacer una array de las etiquetas y valores
-    labels = ["Conductor", "Pasajero", "Peatón", "Desconocido"]
-    values = [cuantos_conductores["Descripcio_tipus_persona"], cuantos_pasajeros["Descripcio_tipus_persona"],
-                                cuantos_peatones["Descripcio_tipus_persona"], cuantos_desconocidos["Descripcio_tipus_persona"]]
-    # construir un array de labels y values para poder ordernar por values
-    labels_values = []
-    for i in range(len(labels)):
-        labels_values.append([labels[i], values[i]])
-    # ordenar el array por values
-    labels_values.sort(key=lambda x: x[1], reverse=True)
-    category_order_pie_chart = []
-    # imprimir array labels_Values
-    for i in range(len(labels_values)):
-        category_order_pie_chart.append(labels_values[i][0])
-
-    # Crear gráfico de pie para mostrar la distribución porcentual de accidentes por sexo
-    fig = px.pie(
-        filtered_data,
-        names="Descripcio_tipus_persona",
-        title=f"Distribución de Accidentes por tipo de persona ({'-'.join(map(str, selected_years))})",
-        labels={"Descripcio_tipus_persona": "Tipo de Persona"},
-        height=500,
-        width=700,
-        hole=0.3,  # Agujero en el centro para hacerlo parecer un donut
-        color_discrete_sequence=scale_color
-    )
-
-    fig.update_traces(insidetextfont=dict(color='white', size=16),
-                      outsidetextfont=dict(color='gray', size=16))
-
-    # Añadir etiquetas con porcentajes
-    if show_percentage:
-        fig.update_traces(textinfo='percent+label', pull=[0.1, 0.1, 0.1])
-    else:
-        fig.update_traces(textinfo='value+label', pull=[0.1, 0.1, 0.1])
-
-    pie_chart_colors = scale_color[:4]
-
-    return fig, pie_chart_colors, category_order_pie_chart
-
-
-def create_victimizacion_pie_chart(data, selected_years, show_percentage):
-    # Filtrar los datos por los años seleccionados
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
-
-    # Calcular el número total de accidentes
-    total_accidents = len(filtered_data)
-
-    victimizacion_mapping = {"Ferit lleu: Amb assistència sanitària en lloc d'accident": "Herido leve",
-                             "Ferit lleu: Hospitalització fins a 24h": "Herido leve",
-                             "Ferit lleu: Rebutja assistència sanitària": "Herido leve",
-                             "Ferit greu: hospitalització superior a 24h": "Herido grave",
-                             "Mort (dins 24h posteriors accident)": "Muerto",
-                             "Mort (després de 24h posteriors accident)": "Muerto",
-                             "Mort natural": "Muerto",
-                             "Il.lès": "Sano",
-                             "Desconegut": "Desconocido",
-                             "Es desconeix": "Desconocido",
-                             }
-
-    filtered_data["Descripcio_victimitzacio"] = filtered_data["Descripcio_victimitzacio"].map(victimizacion_mapping)
-
-    # saber cuantos registros hay de tipo muerto, herido grave, herido leve, sano, desconocido
-    cuantos_muertos = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Muerto"].count()
-    cuantos_heridos_graves = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Herido grave"].count()
-    cuantos_heridos_leves = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Herido leve"].count()
-    cuantos_sanos = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Sano"].count()
-    cuantos_desconocidos = filtered_data[filtered_data["Descripcio_victimitzacio"] == "Desconocido"].count()
-
-    # hacer una array de las etiquetas y valores
-    labels = ["Muerto", "Herido grave", "Herido leve", "Sano", "Desconocido"]
-    values = [cuantos_muertos["Descripcio_victimitzacio"], cuantos_heridos_graves["Descripcio_victimitzacio"],
-                                cuantos_heridos_leves["Descripcio_victimitzacio"], cuantos_sanos["Descripcio_victimitzacio"],
-                                cuantos_desconocidos["Descripcio_victimitzacio"]]
-    # construir un array de labels y values para poder ordernar por values
-    labels_values = []
-    for i in range(len(labels)):
-        labels_values.append([labels[i], values[i]])
-    # ordenar el array por values
-    labels_values.sort(key=lambda x: x[1], reverse=True)
-
-    category_order_pie_chart = []
-    # imprimir array labels_Values
-    for i in range(len(labels_values)):
-        category_order_pie_chart.append(labels_values[i][0])
-
-    # Crear gráfico de pie para mostrar la distribución porcentual de accidentes por sexo
-    fig = px.pie(
-        filtered_data,
-        names="Descripcio_victimitzacio",
-        title=f"Distribución de Accidentes por victimización ({'-'.join(map(str, selected_years))})",
-        labels={"Descripcio_victimitzacio": "Victimización"},
-        height=500,
-        width=700,
-        hole=0.3,  # Agujero en el centro para hacerlo parecer un donut
-        color_discrete_sequence=scale_color
-    )
-
-    fig.update_traces(insidetextfont=dict(color='white', size=16),
-                      outsidetextfont=dict(color='gray', size=16))
-
-    # Añadir etiquetas con porcentajes
-    if show_percentage:
-        fig.update_traces(textinfo='percent+label', pull=[0.1, 0.1, 0.1])
-    else:
-        fig.update_traces(textinfo='value+label', pull=[0.1, 0.1, 0.1])
-
-    pie_chart_colors = scale_color[:5]
-
-
-    return fig, pie_chart_colors, category_order_pie_chart
-
-
-
-def create_sex_line_chart(filtered_data, selected_years, pie_chart_colors, category_order_pie_chart, show_percentage):
-
-
-    # # Filtrar los datos por los años seleccionados
-    # filtered_data = data[data["NK_Any"].isin(selected_years)]
-    #
-    # filtered_data["NK_Any"] = filtered_data["NK_Any"].astype(str)
-    #
-    # sex_mapping = {"Home": "Hombre", "Dona": "Mujer", "Desconegut": "Desconocido"}
-    # filtered_data["Descripcio_sexe"] = filtered_data["Descripcio_sexe"].map(sex_mapping)
-
-    # Agrupar por año y sexo para obtener el número total de implicados en accidentes
-    total_involved = filtered_data.groupby(["NK_Any", "Descripcio_sexe"]).size().reset_index(name="Total Implicados")
-
-    # Calcular los totales para porcentaje si es necesario
-    if show_percentage:
-        total_accidents_by_year = filtered_data.groupby("NK_Any").size().reset_index(name="Total Accidentes")
-        total_involved = pd.merge(total_involved, total_accidents_by_year, on="NK_Any")
-        total_involved["Total Implicados"] = (total_involved["Total Implicados"] / total_involved[
-            "Total Accidentes"]) * 100
-
-    # Formatear el porcentaje a dos decimales
-    total_involved["Total Implicados"] = total_involved["Total Implicados"].round(2)
-
-    # Crear gráfico de líneas para mostrar el número total de implicados en accidentes por sexo
-    fig_line = px.line(
-        total_involved,
-        x="NK_Any",
-        y="Total Implicados",
-        color="Descripcio_sexe",
-        labels={
-            "Total Implicados": "Porcentaje de Implicados (%)" if show_percentage else "Nº total Implicados Accidentes",
-            "NK_Any": "Año", "Descripcio_sexe": "Sexo"},
-
-        title=f"Número Total de Implicados en Accidentes por Sexo ({'-'.join(map(str, selected_years))})",
-        height=500,
-        width=700,
-        color_discrete_sequence=pie_chart_colors,
-        category_orders={"Descripcio_sexe": category_order_pie_chart},  # Aplicar el orden de las categorías
-        text='Total Implicados'
-    )
-
-    # desplazamiento de las etiquetas
-    fig_line.update_traces(textposition='top center')
-
-    return fig_line
+    if "legend" in config:
+        fig.layout.legend.title = config["legend"]
 
+    return fig
 
-def create_age_line_chart(filtered_data, selected_years, pie_chart_colors, category_order_pie_chart, show_percentage):
-    # # Filtrar los datos por los años seleccionados
-    # filtered_data = data[data["NK_Any"].isin(selected_years)]
-    #
-    # filtered_data["NK_Any"] = filtered_data["NK_Any"].astype(str)
-    #
-    # filtered_data["Edat"] = pd.to_numeric(filtered_data["Edat"],
-    #                                       errors="coerce")  # Intenta convertir a numérico, maneja errores como NaN
 
-    # Definir las categorías
-    # bins = [-1, 24, 50, 75, 140]
-    # labels = ["< 25", "25-50", "51-75", "> 75"]
-    #
-    # # Crear una columna categórica
-    # filtered_data["Franja_Edad"] = pd.cut(filtered_data["Edat"], bins=bins, labels=labels)
+def create_distribution_line_chart(dist, selected_years, show_percentage):
+    # Evolución por año de cada categoría, con los mismos colores y orden que el donut
+    dimension = dist["dimension"]
+    config = DISTRIBUTIONS[dimension]
 
-    # Agrupar por año y sexo para obtener el número total de implicados en accidentes
-    total_involved = filtered_data.groupby(["NK_Any", "Franja_Edad"]).size().reset_index(name="Total Implicados")
-
-    # Calcular los totales para porcentaje si es necesario
-    if show_percentage:
-        total_accidents_by_year = filtered_data.groupby("NK_Any").size().reset_index(name="Total Accidentes")
-        total_involved = pd.merge(total_involved, total_accidents_by_year, on="NK_Any")
-        total_involved["Total Implicados"] = (total_involved["Total Implicados"] / total_involved[
-            "Total Accidentes"]) * 100
+    # número total de implicados por año y categoría (o porcentaje sobre el total del año)
+    total_involved = trend(dist, show_percentage).rename(columns={"Total": "Total Implicados"})
+    total_involved["NK_Any"] = total_involved["NK_Any"].astype(str)
 
     # Formatear el porcentaje a dos decimales
     total_involved["Total Implicados"] = total_involved["Total Implicados"].round(2)
 
-    # Crear gráfico de líneas para mostrar el número total de implicados en accidentes por sexo
+    # Crear gráfico de líneas para mostrar el número total de implicados en accidentes
     fig_line = px.line(
         total_involved,
         x="NK_Any",
         y="Total Implicados",
-        color="Franja_Edad",
+        color=dimension,
         labels={
             "Total Implicados": "Porcentaje de Implicados (%)" if show_percentage else "Nº total Implicados Accidentes",
-            "NK_Any": "Año", "Franja_Edad": "Edad"},
+            "NK_Any": "Año", dimension: config["label"]},
 
-        title=f"Número Total de Implicados en Accidentes por Franja de Edad ({'-'.join(map(str, selected_years))})",
+        title=f"Número Total de Implicados en Accidentes por {config['trend_title']} "
+              f"({'-'.join(map(str, selected_years))})",
         height=500,
         width=700,
-        color_discrete_sequence=pie_chart_colors,
-        category_orders={"Franja_Edad": category_order_pie_chart, "NK_Any": selected_years},
-        # Aplicar el orden de las categorías
+        color_discrete_sequence=scale_color,
+        category_orders={dimension: dist["totals"].index.tolist()},  # Aplicar el orden del donut
         text='Total Implicados'
     )
 
     # desplazamiento de las etiquetas
     fig_line.update_traces(textposition='top center')
-    fig_line.layout.legend.title = "Grupo de Edad"
-
-    return fig_line
 
-
-def create_personas_line_chart(data, selected_years, pie_chart_colors, category_order_pie_chart, show_percentage):
-    # Filtrar los datos por los años seleccionados
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
-
-    filtered_data["NK_Any"] = filtered_data["NK_Any"].astype(str)
-
-    personas_mapping = {"Conductor": "Conductor", "Vianant": "Peatón", "Passatger": "Pasajero", "Desconegut": "Desconocido"}
-    filtered_data["Descripcio_tipus_persona"] = filtered_data["Descripcio_tipus_persona"].map(personas_mapping)
-
-    # Agrupar por año y sexo para obtener el número total de implicados en accidentes
-    total_involved = filtered_data.groupby(["NK_Any", "Descripcio_tipus_persona"]).size().reset_index(name="Total Implicados")
-
-    # Calcular los totales para porcentaje si es necesario
-    if show_percentage:
-        total_accidents_by_year = filtered_data.groupby("NK_Any").size().reset_index(name="Total Accidentes")
-        total_involved = pd.merge(total_involved, total_accidents_by_year, on="NK_Any")
-        total_involved["Total Implicados"] = (total_involved["Total Implicados"] / total_involved[
-            "Total Accidentes"]) * 100
-
-    # Formatear el porcentaje a dos decimales
-    total_involved["Total Implicados"] = total_involved["Total Implicados"].round(2)
-
-    # Crear gráfico de líneas para mostrar el número total de implicados en accidentes por sexo
-    fig_line = px.line(
-        total_involved,
-        x="NK_Any",
-        y="Total Implicados",
-        color="Descripcio_tipus_persona",
-        labels={
-            "Total Implicados": "Porcentaje de Implicados (%)" if show_percentage else "Nº total Implicados Accidentes",
-            "NK_Any": "Año", "Descripcio_tipus_persona": "Sexo"},
-
-        title=f"Número Total de Implicados en Accidentes por tipo de persona ({'-'.join(map(str, selected_years))})",
-        height=500,
-        width=700,
-        color_discrete_sequence=pie_chart_colors,
-        category_orders={"Descripcio_tipus_persona": category_order_pie_chart},  # Aplicar el orden de las categorías
-        text='Total Implicados'
-    )
-
-    # desplazamiento de las etiquetas
-    fig_line.update_traces(textposition='top center')
+    if "legend" in config:
+        fig_line.layout.legend.title = config["legend"]
 
     return fig_line
 
 
-
-def create_victimizacion_line_chart(data, selected_years, pie_chart_colors, category_order_pie_chart, show_percentage):
-    # Filtrar los datos por los años seleccionados
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
-
-    filtered_data["NK_Any"] = filtered_data["NK_Any"].astype(str)
-
-    victimizacion_mapping = {"Ferit lleu: Amb assistència sanitària en lloc d'accident": "Herido leve",
-                             "Ferit lleu: Hospitalització fins a 24h": "Herido leve",
-                             "Ferit lleu: Rebutja assistència sanitària": "Herido leve",
-                             "Ferit greu: hospitalització superior a 24h": "Herido grave",
-                             "Mort (dins 24h posteriors accident)": "Muerto",
-                             "Mort (després de 24h posteriors accident)": "Muerto",
-                             "Mort natural": "Muerto",
-                             "Il.lès": "Sano",
-                             "Desconegut": "Desconocido",
-                             "Es desconeix": "Desconocido",
-                             }
-
-    filtered_data["Descripcio_victimitzacio"] = filtered_data["Descripcio_victimitzacio"].map(victimizacion_mapping)
-
-    # Agrupar por año y sexo para obtener el número total de implicados en accidentes
-    total_involved = filtered_data.groupby(["NK_Any", "Descripcio_victimitzacio"]).size().reset_index(name="Total Implicados")
-
-    # Calcular los totales para porcentaje si es necesario
-    if show_percentage:
-        total_accidents_by_year = filtered_data.groupby("NK_Any").size().reset_index(name="Total Accidentes")
-        total_involved = pd.merge(total_involved, total_accidents_by_year, on="NK_Any")
-        total_involved["Total Implicados"] = (total_involved["Total Implicados"] / total_involved[
-            "Total Accidentes"]) * 100
-
-    # Formatear el porcentaje a dos decimales
-    total_involved["Total Implicados"] = total_involved["Total Implicados"].round(2)
-
-    # Crear gráfico de líneas para mostrar el número total de implicados en accidentes por sexo
-    fig_line = px.line(
-        total_involved,
-        x="NK_Any",
-        y="Total Implicados",
-        color="Descripcio_victimitzacio",
-        labels={
-            "Total Implicados": "Porcentaje de Implicados (%)" if show_percentage else "Nº total Implicados Accidentes",
-            "NK_Any": "Año", "Descripcio_victimitzacio": "Victimización"},
-
-        title=f"Número Total de Implicados en Accidentes victimización ({'-'.join(map(str, selected_years))})",
-        height=500,
-        width=700,
-        color_discrete_sequence=pie_chart_colors,
-        category_orders={"Descripcio_victimitzacio": category_order_pie_chart},  # Aplicar el orden de las categorías
-        text='Total Implicados'
-    )
-
-    # desplazamiento de las etiquetas
-    fig_line.update_traces(textposition='top center')
-
-    return fig_line
-
 def page_sexo():
     st.title("Distribución de Accidentes por Sexo")
-    # Cargar datos
-    data = load_data()
+    # Cargar el cubo de recuentos
+    cube = load_cube()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data["NK_Any"].unique())
+    available_years = sorted(rollup(cube, ["NK_Any"])["NK_Any"])
 
     # Checkbox para seleccionar los años
     selected_years = sorted(st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years))
@@ -700,23 +727,21 @@ def page_sexo():
     show_percentage = st.sidebar.radio("Mostrar en:", ["Porcentaje", "Valor Real"]) == "Porcentaje"
 
     # Filtrar los datos por los años seleccionados
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
-
-    filtered_data["NK_Any"] = filtered_data["NK_Any"].astype(str)
+    where = {"NK_Any": selected_years}
 
 
     # Poner un checkbox para mostrar los datos de sexo (muertos)
     if st.sidebar.checkbox("Mostrar solo muertos", value=False):
-        # filtrar los datos que contiene la palabra "Mort"
-        filtered_data = filtered_data[filtered_data["Descripcio_victimitzacio"].str.contains("Mort")]
+        # filtrar los fallecidos (marca precalculada)
+        where["Muerto"] = True
 
 
-    sex_mapping = {"Home": "Hombre", "Dona": "Mujer", "Desconegut": "Desconocido"}
-    filtered_data["Descripcio_sexe"] = filtered_data["Descripcio_sexe"].map(sex_mapping)
+    if total(cube, where)>0:
+        # Reparto por año y sexo (una sola consulta al cubo)
+        dist = distribution(cube, "Descripcio_sexe_es", where)
 
-    if len(filtered_data)>0:
-        # Obtener sexo predominante (sex mapping)
-        sex_predominant = filtered_data["Descripcio_sexe"].value_counts().index[0]
+        # Obtener sexo predominante (categorías ya traducidas)
+        sex_predominant = dist["totals"].index[0]
 
         if selected_years[0] == selected_years[1]:
             años = f"{selected_years[0]}"
@@ -730,13 +755,11 @@ def page_sexo():
 
 
         # Crear pie chart
-        fig_pie, pie_chart_colors, category_order_pie_chart = create_sex_pie_chart(filtered_data, sorted(selected_years),
-                                                                                   show_percentage)
+        fig_pie = create_distribution_pie_chart(dist, sorted(selected_years), show_percentage)
 
         if len(selected_years) > 1:
             # Crear gráfica de líneas
-            fig_line = create_sex_line_chart(filtered_data, sorted(selected_years), pie_chart_colors, category_order_pie_chart,
-                                             show_percentage)
+            fig_line = create_distribution_line_chart(dist, sorted(selected_years), show_percentage)
             # Colocar las dos gráficas una al lado de la otra
             col1, col2 = st.columns(2)
 
@@ -754,11 +777,11 @@ def page_sexo():
 
 def page_personas():
     st.title("Distribución de Accidentes por Tipos de Persona")
-    # Cargar datos
-    data = load_data()
+    # Cargar el cubo de recuentos
+    cube = load_cube()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data["NK_Any"].unique())
+    available_years = sorted(rollup(cube, ["NK_Any"])["NK_Any"])
 
     # Checkbox para seleccionar los años
     selected_years = sorted(st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years))
@@ -766,15 +789,20 @@ def page_personas():
     # Radio para seleccionar entre porcentaje y valor real
     show_percentage = st.sidebar.radio("Mostrar en:", ["Porcentaje", "Valor Real"]) == "Porcentaje"
 
+    where = {}
     # Poner un checkbox para mostrar los datos de sexo (muertos)
     if st.sidebar.checkbox("Mostrar solo muertos", value=False):
-        # filtrar los datos que contiene la palabra "Mort"
-        data = data[data["Descripcio_victimitzacio"].str.contains("Mort")]
+        # solo los fallecidos (marca precalculada)
+        where["Muerto"] = True
 
 
-    if len(data)>0:
+    if total(cube, where)>0:
         # Obtener cual es el tipo de persona predominante
-        personas_predominant = data["Descripcio_tipus_persona"].value_counts().index[0]
+        personas_predominant = rollup(cube, ["Descripcio_tipus_persona_es"], where).set_index(
+            "Descripcio_tipus_persona_es")["Personas"].idxmax()
+
+        # Reparto por año y tipo de persona en los años seleccionados
+        dist = distribution(cube, "Descripcio_tipus_persona_es", {**where, "NK_Any": selected_years})
 
         # Obtener la variable años
         if selected_years[0] == selected_years[1]:
@@ -785,16 +813,14 @@ def page_personas():
 
 
         # Crear pie chart
-        fig_pie, pie_chart_colors, category_order_pie_chart = create_personas_pie_chart(data, sorted(selected_years),
-                                                                                   show_percentage)
+        fig_pie = create_distribution_pie_chart(dist, sorted(selected_years), show_percentage)
 
         if len(selected_years) > 0:
             st.markdown(f"""El tipo de persona predominante en accidentes entre **:gray[{años}]** es: **:red[{str(personas_predominant)}]**.\n""")
 
         if len(selected_years) > 1:
             # Crear gráfica de líneas
-            fig_line = create_personas_line_chart(data, sorted(selected_years), pie_chart_colors, category_order_pie_chart,
-                                             show_percentage)
+            fig_line = create_distribution_line_chart(dist, sorted(selected_years), show_percentage)
             # Colocar las dos gráficas una al lado de la otra
             col1, col2 = st.columns(2)
 
@@ -809,11 +835,11 @@ def page_personas():
                     """)
 def page_edad():
     st.title("Distribución de Accidentes por franjas de edad")
-    # Cargar datos
-    data = load_data()
+    # Cargar el cubo de recuentos
+    cube = load_cube()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data["NK_Any"].unique())
+    available_years = sorted(rollup(cube, ["NK_Any"])["NK_Any"])
 
     # Checkbox para seleccionar los años
     selected_years = sorted(st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years))
@@ -822,46 +848,29 @@ def page_edad():
     show_percentage = st.sidebar.radio("Mostrar en:", ["Porcentaje", "Valor Real"]) == "Porcentaje"
 
     # Filtrar los datos por los años seleccionados
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
-
-    # quitamos los nulos y valores vacios
-    filtered_data = filtered_data[filtered_data["Edat"] != "Desconegut"]
-    filtered_data = filtered_data[filtered_data["Edat"] != "-1"]
-    # drop na
-    filtered_data = filtered_data.dropna(subset=["Edat"])
-    # quitar categoria null de mis datos
-    filtered_data = filtered_data[filtered_data["Edat"].notnull()]
-
-    filtered_data["Edat"] = pd.to_numeric(filtered_data["Edat"],
-                                          errors="coerce")  # Intenta convertir a numérico, maneja errores como NaN
-
-    # Definir las categorías
-    bins = [-1, 24, 50, 75, 140]
-    labels = ["< 25", "25-50", "51-75", "> 75"]
-
-    # Crear una columna categórica
-    filtered_data["Franja_Edad"] = pd.cut(filtered_data["Edat"], bins=bins, labels=labels)
+    where = {"NK_Any": selected_years}
 
     # Poner un checkbox para mostrar los datos de sexo (muertos)
     if st.sidebar.checkbox("Mostrar solo muertos", value=False):
-        # filtrar los datos que contiene la palabra "Mort"
-        filtered_data = filtered_data[filtered_data["Descripcio_victimitzacio"].str.contains("Mort")]
+        # filtrar los fallecidos (marca precalculada)
+        where["Muerto"] = True
+
+    # Reparto por año y franja de edad ("Franja_Edad" precalculada, sin las edades desconocidas)
+    dist = distribution(cube, "Franja_Edad", where, dropna=True)
 
-    if len(filtered_data)>0:
+    if len(dist["totals"])>0:
         # Obtener la franja más común
-        age_group = filtered_data["Franja_Edad"].value_counts().index[0]
+        age_group = dist["totals"].index[0]
 
         st.markdown(f"""La franja de edad que acumula más accidente entre
          **:gray[{selected_years[0]}-{selected_years[-1]}]** es la de **:red[{str(age_group)}] años**.\n""")
 
         # Crear pie chart
-        fig_pie, pie_chart_colors, category_order_pie_chart = create_age_pie_chart(filtered_data, sorted(selected_years),
-                                                                                   show_percentage)
+        fig_pie = create_distribution_pie_chart(dist, sorted(selected_years), show_percentage)
 
         if len(selected_years) > 1:
             # Crear gráfica de líneas
-            fig_line = create_age_line_chart(filtered_data, sorted(selected_years), pie_chart_colors, category_order_pie_chart,
-                                             show_percentage)
+            fig_line = create_distribution_line_chart(dist, sorted(selected_years), show_percentage)
             # Colocar las dos gráficas una al lado de la otra
             col1, col2 = st.columns(2)
 
@@ -878,49 +887,26 @@ def page_histograma_edad():
     st.title("Distribución de Accidentes por edad")
 
     # Cargar datos
-    data = load_data()
+    bitmaps = load_bitmaps()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data["NK_Any"].unique())
+    available_years = index_values(bitmaps, "NK_Any")
 
     # Checkbox para seleccionar los años
     selected_years = st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years)
 
     st.sidebar.button("Recargar datos")
 
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
-
-    # Calcular el número máximo de vehículos implicados
-    max_vehicles = filtered_data.groupby("Numero_expedient")["Numero_expedient"].transform("count").max()
-
-    # Filtrar los valores "Desconegut"
-    unknown_mask = filtered_data["Edat"] == "Desconegut"
-    unknown_values = filtered_data.loc[unknown_mask, "Edat"]
-
-    # Eliminar temporalmente los valores "Desconegut"
-    filtered_data.loc[unknown_mask, "Edat"] = None
-    filtered_data = filtered_data.sort_values(by="NK_Any")
-
-    # quitamos los nulos y valores vacios
-    filtered_data = filtered_data[filtered_data["Edat"] != "Desconegut"]
-    filtered_data = filtered_data[filtered_data["Edat"] != "-1"]
-    # drop na
-    filtered_data = filtered_data.dropna(subset=["Edat"])
-    # quitar categoria null de mis datos
-    filtered_data = filtered_data[filtered_data["Edat"].notnull()]
-
-    filtered_data["Edat"] = pd.to_numeric(filtered_data["Edat"],
-                                          errors="coerce")  # Intenta convertir a numérico, maneja errores como NaN
-
     # Poner un checkbox para mostrar los datos de sexo (muertos)
-    if st.sidebar.checkbox("Mostrar solo muertos", value=False):
-        # filtrar los datos que contiene la palabra "Mort"
-        filtered_data = filtered_data[filtered_data["Descripcio_victimitzacio"].str.contains("Mort")]
+    muertos = st.sidebar.checkbox("Mostrar solo muertos", value=False)
 
     # obtener los años eleccionados en el multiselect
     selected_years = sorted(selected_years)
 
-    if len(filtered_data) > 0:
+    # histograma de cada año seleccionado (cacheado por año, las edades desconocidas no cuentan)
+    histograms = load_age_histograms(selected_years, muertos)
+
+    if sum(int(hist["count"].sum()) for hist in histograms) > 0:
 
         if len(selected_years) == 0:
             st.markdown("Seleccionar algun año para mostrar el histograma.")
@@ -937,30 +923,36 @@ def page_histograma_edad():
             st.markdown(f"""Mostramos la distribución de accidentes por edad entre **:gray[{años}]**.\n""")
 
 
-            # Crear un histograma interactivo con plotly
-            fig = px.histogram(
-                filtered_data,
-                x="Edat",
-                nbins=20,
+            # Crear un histograma interactivo con plotly (intervalos de 5 años contados en el servidor)
+            fig = px.bar(
+                merge_histograms(histograms),
+                x="x",
+                y="count",
                 title=f"Distribución de Accidentes por Edad en {años}",
-                labels={"Edat": "Edad", "count": "Frecuencia"},
+                labels={"x": "Edad", "count": "Frecuencia"},
                 color_discrete_sequence=scale_color,
             )
+            fig.update_traces(width=5)
+            fig.update_layout(bargap=0)
             st.plotly_chart(fig, use_container_width=True)
 
             if len(selected_years)>1:
-                fig_evolution = px.histogram(
-                    filtered_data,
-                    x="Edat",
-                    nbins=20,
+                # un histograma por año, con los mismos intervalos
+                bins_by_year = merge_histograms(histograms, by="NK_Any", keys=selected_years)
+                bins_by_year["NK_Any"] = bins_by_year["NK_Any"].astype(str)
+                fig_evolution = px.bar(
+                    bins_by_year,
+                    x="x",
+                    y="count",
                     color="NK_Any",
                     title="Distribución de Accidentes por Edad en los años seleccionados",
                     facet_col="NK_Any",
-                    labels={"Edat": "Edad", "count": "Frecuencia", "NK_Any": "Año"},
+                    labels={"x": "Edad", "count": "Frecuencia", "NK_Any": "Año"},
                     color_discrete_sequence=scale_color,
                 )
 
-                fig_evolution.update_xaxes(categoryorder="total ascending")
+                fig_evolution.update_traces(width=5)
+                fig_evolution.update_layout(bargap=0)
                 st.plotly_chart(fig_evolution, use_container_width=True)
     else:
         st.markdown(f"""No hay datos para mostrar con los filtros seleccionados.\n""")
@@ -1022,65 +1014,169 @@ def page_histograma_edad():
 
 def page_mapa():
     st.title("Mapa Accidentes en Barcelona")
-    # Cargar datos
-    data = load_data()
+    # Cargar el índice de bitmaps de las personas
+    bitmaps = load_bitmaps()
 
     # Multiselect para años
-    selected_years = st.sidebar.multiselect("Seleccionar Años", sorted(data["NK_Any"].unique()),
-                                            default=sorted(data["NK_Any"].unique()))
+    selected_years = st.sidebar.multiselect("Seleccionar Años", index_values(bitmaps, "NK_Any"),
+                                            default=index_values(bitmaps, "NK_Any"))
 
     # Checkbox para tipos de vehículo
-    all_vehicle_types = sorted(data["Desc_Tipus_vehicle_implicat"].unique())
+    all_vehicle_types = index_values(bitmaps, "Desc_Tipus_vehicle_implicat")
     selected_vehicle_types = st.sidebar.multiselect("Seleccionar Tipos de Vehículo", all_vehicle_types,
                                                     default=all_vehicle_types)
 
-    filtered_data = data[data["NK_Any"].isin(selected_years) &
-                         data["Desc_Tipus_vehicle_implicat"].isin(selected_vehicle_types)]
-
-    location_data = filtered_data.groupby(["Latitud", "Longitud"]).size().reset_index(name="Vehículos Implicados")
-
-    # Crear una nueva columna que represente la intensidad
-    location_data["Intensidad"] = location_data["Vehículos Implicados"] / location_data["Vehículos Implicados"].max()
-
-    # Definir una escala de colores personalizada
-    color_scale = [
-        [0, "green"],
-        [0.5, "orange"],
-        [1, "red"]
-    ]
-
-    # Crear el mapa
-    fig = px.scatter_mapbox(
-        location_data,
-        lat="Latitud",
-        lon="Longitud",
-        hover_data=["Vehículos Implicados"],
-        # Información adicional que se mostrará al pasar el ratón sobre los puntos
-        title="Número de Vehículos Implicados en Accidentes de Tráfico en Barcelona",
-        labels={"Desc_Tipus_vehicle_implicat": "Tipo de Vehículo", "Vehículos Implicados": "Num. Vehículos"},
-        mapbox_style="carto-positron",  # Estilo del mapa (puedes elegir otros estilos)
-        height=600,
-        size="Vehículos Implicados",
-        size_max=8,
-        opacity=0.7,
-        color="Vehículos Implicados",  # Columna que se utilizará para la escala de colores
-        color_continuous_scale=color_scale
-    )
+    # Nivel de zoom del mapa: los puntos se agrupan en celdas de unos pocos píxeles a ese zoom y el mapa
+    # recibe una marca por celda con su total (ver mapgrid.py)
+    zoom = st.sidebar.select_slider("Nivel de zoom del mapa", options=ZOOM_LEVELS, value=11)
+    grid = load_grid()
+    index = load_spatial_index()
+
+    # Inspeccionar los alrededores de un punto: el mapa se centra en él y se muestran los accidentes
+    # que hay a menos de la distancia elegida y los más cercanos (consultas del índice espacial)
+    inspect = st.sidebar.checkbox("Inspeccionar alrededores")
+    center = CENTER
+    if inspect:
+        # solo puntos dentro de Barcelona
+        lat_min, lat_max, lon_min, lon_max = BARCELONA_BOUNDS
+        center = {"lat": st.sidebar.number_input("Latitud", min_value=lat_min, max_value=lat_max, value=CENTER["lat"],
+                                                 format="%.5f", step=0.001),
+                  "lon": st.sidebar.number_input("Longitud", min_value=lon_min, max_value=lon_max, value=CENTER["lon"],
+                                                 format="%.5f", step=0.001)}
+        meters = st.sidebar.slider("Radio (metros)", min_value=50, max_value=1000, value=200, step=50)
+
+    # Modo del mapa: marcas por celda o imagen de densidad dibujada en el servidor (ver raster.py), cuyo
+    # coste en el navegador no depende del número de accidentes
+    mode = st.sidebar.radio("Modo del mapa", ["Celdas", "Densidad"])
+    by_severity = mode == "Densidad" and st.sidebar.checkbox("Colorear por gravedad")
+
+    # Puntos negros: zonas donde se repiten los accidentes, como otra capa del mapa (ver hotspot.py)
+    show_hotspots = st.sidebar.checkbox("Mostrar puntos negros")
+    if show_hotspots:
+        hotspots_muertos = st.sidebar.checkbox("Puntos negros solo con muertos")
+        eps = st.sidebar.slider("Tamaño de las celdas (metros)", min_value=25, max_value=200, value=int(EPS), step=25)
+        min_points = st.sidebar.slider("Accidentes mínimos por celda", min_value=2, max_value=30, value=MIN_POINTS)
+
+    where = {"NK_Any": selected_years, "Desc_Tipus_vehicle_implicat": selected_vehicle_types}
+    mask = select(bitmaps, where)
+    if mode == "Densidad":
+        # Una imagen de la zona visible (con su margen) con los recuentos por píxel
+        bounds = viewport(zoom, center)
+        shape = raster_shape(VIEWPORT_PIXELS, VIEWPORT_MARGIN)
+        if by_severity:
+            # los colores se buscan por el nombre de cada categoría, en el orden de sus códigos
+            severity = load_data()["Gravedad"]
+            counts = rasterize(grid["lat"], grid["lon"], bounds, shape, mask, severity.cat.codes.to_numpy(),
+                               len(severity.cat.categories))
+            image = shade(counts, [SEVERITY_COLORS[category] for category in severity.cat.categories])
+        else:
+            image = shade(rasterize(grid["lat"], grid["lon"], bounds, shape, mask))
+
+        fig = px.scatter_mapbox(
+            pd.DataFrame({"Latitud": [], "Longitud": []}),
+            lat="Latitud",
+            lon="Longitud",
+            title="Densidad de Vehículos Implicados en Accidentes de Tráfico en Barcelona",
+            mapbox_style="carto-positron",
+            height=600,
+        )
+        fig.update_layout(
+            margin={"r": 0, "t": 40, "l": 0, "b": 0},
+            mapbox={"zoom": zoom, "center": center, "layers": [image_layer(to_data_uri(image), bounds)]},
+        )
+        if by_severity:
+            # leyenda de los colores de cada gravedad (trazas sin puntos)
+            for severity, color in SEVERITY_COLORS.items():
+                fig.add_scattermapbox(lat=[None], lon=[None], mode="markers", name=severity,
+                                      marker={"size": 10, "color": f"rgb{color}"})
+    else:
+        # Solo se agregan las filas seleccionadas que caen en la zona visible del mapa
+        location_data = aggregate(grid, zoom, viewport_mask(index, zoom, center, mask), "Vehículos Implicados")
+
+        # Crear una nueva columna que represente la intensidad
+        location_data["Intensidad"] = (location_data["Vehículos Implicados"] /
+                                       location_data["Vehículos Implicados"].max())
+
+        # Definir una escala de colores personalizada
+        color_scale = [
+            [0, "green"],
+            [0.5, "orange"],
+            [1, "red"]
+        ]
+
+        # Crear el mapa
+        fig = px.scatter_mapbox(
+            location_data,
+            lat="Latitud",
+            lon="Longitud",
+            hover_data=["Vehículos Implicados"],
+            # Información adicional que se mostrará al pasar el ratón sobre los puntos
+            title="Número de Vehículos Implicados en Accidentes de Tráfico en Barcelona",
+            labels={"Desc_Tipus_vehicle_implicat": "Tipo de Vehículo", "Vehículos Implicados": "Num. Vehículos"},
+            mapbox_style="carto-positron",  # Estilo del mapa (puedes elegir otros estilos)
+            height=600,
+            size="Vehículos Implicados",
+            size_max=8,
+            opacity=0.7,
+            color="Vehículos Implicados",  # Columna que se utilizará para la escala de colores
+            color_continuous_scale=color_scale
+        )
 
-    # Personalizar el diseño del mapa
-    fig.update_layout(
-        margin={"r": 0, "t": 40, "l": 0, "b": 0},  # Márgenes del mapa
-        mapbox={"zoom": 11, "center": {"lat": 41.3851, "lon": 2.1734}},  # Nivel de zoom inicial
-    )
-    fig.update_traces(
-        hovertemplate='Num. Vehículos: <b>%{customdata[0]}</b><extra></extra>'
-    )
+        # Personalizar el diseño del mapa
+        fig.update_layout(
+            margin={"r": 0, "t": 40, "l": 0, "b": 0},  # Márgenes del mapa
+            mapbox={"zoom": zoom, "center": center},  # Nivel de zoom inicial
+        )
+        fig.update_traces(
+            hovertemplate='Num. Vehículos: <b>%{customdata[0]}</b><extra></extra>'
+        )
+    if show_hotspots:
+        clusters = load_hotspots(selected_years, selected_vehicle_types, hotspots_muertos, float(eps), min_points)
+        fig.update_layout(mapbox_layers=list(fig.layout.mapbox.layers) + [
+            {"sourcetype": "geojson", "source": to_geojson(clusters), "type": "fill", "color": "purple",
+             "opacity": 0.3},
+            {"sourcetype": "geojson", "source": to_geojson(clusters), "type": "line", "color": "purple"},
+        ])
+        fig.add_scattermapbox(lat=clusters["Latitud"], lon=clusters["Longitud"], mode="markers", showlegend=False,
+                              marker={"size": 6, "color": "purple"},
+                              customdata=clusters[["Punto_negro", "Accidentes", "Nom_carrer"]],
+                              hovertemplate="Punto negro %{customdata[0]}: <b>%{customdata[1]}</b> accidentes"
+                                            "<br>%{customdata[2]}<extra></extra>")
+    if inspect:
+        fig.add_scattermapbox(lat=[center["lat"]], lon=[center["lon"]], mode="markers", showlegend=False,
+                              marker={"size": 14, "color": "blue"}, hovertemplate="Punto inspeccionado<extra></extra>")
 
     # Mostrar el mapa
     st.plotly_chart(fig, use_container_width=True)
 
-    # generar mapa con solo muertos en accidentes: contiene la palabra "Mort"
-    filtered_data_muertos = filtered_data[filtered_data["Descripcio_victimitzacio"].str.contains("Mort")]
+    if show_hotspots:
+        st.write(f"Puntos negros: {len(clusters)} zonas con {clusters['Accidentes'].sum()} accidentes. "
+                 "Los de más accidentes:")
+        st.dataframe(clusters[["Punto_negro", "Nom_carrer", "Accidentes", "Filas"]].head(10).rename(
+            columns={"Punto_negro": "Punto negro", "Nom_carrer": "Calle", "Filas": "Vehículos Implicados"}),
+            hide_index=True)
+
+    if inspect:
+        data = load_data()
+        rows, distances = radius(index, center["lat"], center["lon"], meters, mask)
+        st.subheader(f"Accidentes a menos de {meters} metros del punto")
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Accidentes", data["Numero_expedient"].iloc[rows].nunique())
+        col2.metric("Vehículos Implicados", len(rows))
+        col3.metric("Muertos", int((data["Gravedad"].iloc[rows] == "Mortal").sum()))
+
+        # un accidente por expediente (su fila más cercana)
+        rows, distances = nearest(index, center["lat"], center["lon"], 10, mask, index["groups"])
+        nearest_data = data.iloc[rows][["Numero_expedient", "NK_Any", "Nom_carrer", "Desc_Tipus_vehicle_implicat",
+                                        "Gravedad"]].reset_index(drop=True)
+        nearest_data.insert(0, "Distancia (m)", np.round(distances).astype(int))
+        st.write("Accidentes más cercanos al punto:")
+        st.dataframe(nearest_data, hide_index=True)
+
+    # generar mapa con solo muertos en accidentes (vista precalculada de fallecidos)
+    data_muertos = load_fatal_data()
+    filtered_data_muertos = data_muertos[data_muertos["NK_Any"].isin(selected_years) &
+                                         data_muertos["Desc_Tipus_vehicle_implicat"].isin(selected_vehicle_types)]
 
     # crear una nueva columna con el numero de muertos por expediente
     filtered_data_muertos["Muertos"] = filtered_data_muertos.groupby(["Numero_expedient"])["Numero_expedient"].transform("count")
@@ -1089,8 +1185,9 @@ def page_mapa():
     total_muertos = filtered_data_muertos["Muertos"].sum()
 
 
-    # Agrupar por expediente
-    location_data_muertos = filtered_data_muertos.groupby(["Latitud", "Longitud"]).size().reset_index(name="Muertos")
+    # Agrupar por celdas (las mismas que en el mapa de vehículos, filtrando los fallecidos con su bitmap)
+    mask_muertos = select(bitmaps, {**where, "Gravedad": "Mortal"})
+    location_data_muertos = aggregate(grid, zoom, viewport_mask(index, zoom, center, mask_muertos), "Muertos")
 
 
 
@@ -1123,7 +1220,7 @@ def page_mapa():
     # Personalizar el diseño del mapa
     fig.update_layout(
         margin={"r": 0, "t": 40, "l": 0, "b": 0},  # Márgenes del mapa
-        mapbox={"zoom": 11, "center": {"lat": 41.3851, "lon": 2.1734}},  # Nivel de zoom inicial
+        mapbox={"zoom": zoom, "center": center},  # Nivel de zoom inicial
     )
     fig.update_traces(
         hovertemplate='Muertos: <b>%{customdata[0]}</b><extra></extra>'
@@ -1136,29 +1233,26 @@ def page_mapa():
 
 def page_distritos_barrios():
     st.title("Distribución accidente por distritos y barrios")
-    # Cargar datos
-    data = load_data()
+    # Cargar el cubo de recuentos de accidentes
+    cube = load_accidents_cube()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data["NK_Any"].unique())
+    available_years = sorted(rollup(cube, ["NK_Any"])["NK_Any"])
 
     # Checkbox para seleccionar los años
     selected_years = st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years)
 
-    filtered_data = data[data["NK_Any"].isin(selected_years)]
+    where = {"NK_Any": selected_years}
 
     texto = "accidentes"
     # Poner un checkbox para mostrar los datos de sexo (muertos)
     if st.sidebar.checkbox("Mostrar solo muertos", value=False):
-        # filtrar los datos que contiene la palabra "Mort"
-        filtered_data = filtered_data[filtered_data["Descripcio_victimitzacio"].str.contains("Mort")]
+        # filtrar los accidentes con algún muerto
+        where["Muerto"] = True
         texto = "muertos"
 
-    # agrupar por expediente
-    filtered_data = filtered_data.groupby(["Numero_expedient"]).first().reset_index()
-
-    # get total accidents by Year and District
-    total_accidents = filtered_data.groupby(["Nom_districte", "Nom_barri"]).size().reset_index(name="Accidentes")
+    # get total accidents by District and Barrio
+    total_accidents = rollup(cube, ["Nom_districte", "Nom_barri"], where)
 
     fig = px.treemap(
         total_accidents,
@@ -1172,31 +1266,25 @@ def page_distritos_barrios():
     # Mostrar el gráfico
     st.plotly_chart(fig, use_container_width=True)
 
+    muertos = "Muerto" in where
+
     # print metric values for the 3 barrios with more accidents
-    # get top 3 barrios with more accidents
-    top3_barrios = total_accidents.groupby(["Nom_districte", "Nom_barri"])["Accidentes"].sum().nlargest(3)
-    # get the top 3 barrios
-    top3_barrios = top3_barrios.reset_index()
+    # get top 3 barrios with more accidents (índice de rankings, ver ranking.py)
+    top3_barrios = load_top("Nom_barri", selected_years, muertos, 3)
     # get the top 3 barrios names
     top3_barrios_names = top3_barrios["Nom_barri"].tolist()
     # get the top 3 barrios accidents
-    top3_barrios_accidents = top3_barrios["Accidentes"].tolist()
+    top3_barrios_accidents = top3_barrios["count"].tolist()
     # get the top 3 barrios districts
     top3_barrios_districts = top3_barrios["Nom_districte"].tolist()
 
     # create a dataframe with the top 3 barrios
     top3_barrios_df = pd.DataFrame(
         {'Distrito': top3_barrios_districts, 'Barrio': top3_barrios_names, 'Accidentes': top3_barrios_accidents})
+    # accidentes de cada año seleccionado
+    totals_by_year = load_year_totals(selected_years, muertos)
     # get the total accidents
-    total_accidents_year = filtered_data.groupby(["NK_Any"]).size().reset_index(name="Accidentes")
-    # get the total accidents by year
-    total_accidents_by_year = total_accidents_year.groupby(["NK_Any"])["Accidentes"].sum()
-    # get the total accidents by year
-    total_accidents_by_year = total_accidents_by_year.reset_index()
-    # get the total accidents by year
-    total_accidents_by_year = total_accidents_by_year["Accidentes"].tolist()
-    # get the total accidents by year
-    total_accidents_by_year = sum(total_accidents_by_year)
+    total_accidents_by_year = int(totals_by_year.sum())
     if len(selected_years) > 0:
         total_accidents_by_year = total_accidents_by_year / len(selected_years)
     else:
@@ -1205,9 +1293,7 @@ def page_distritos_barrios():
     total_accidents_by_year = round(total_accidents_by_year, 2)
 
     # get total 3 districts with more accidents
-    top3_districts = total_accidents.groupby(["Nom_districte"])["Accidentes"].sum().nlargest(3)
-    # get the top 3 districts
-    top3_districts = top3_districts.reset_index()
+    top3_districts = load_top("Nom_districte", selected_years, muertos, 3).rename(columns={"count": "Accidentes"})
     # get the top 3 districts names
     top3_districts_names = top3_districts["Nom_districte"].tolist()
     # get the top 3 districts accidents
@@ -1218,30 +1304,24 @@ def page_distritos_barrios():
     # show the average accidents by year, aligned to center
     col1.metric(label=f"Media {texto} por año", value=total_accidents_by_year)
     # get the "Nom_carrer" with most accidents
-    top_calle = filtered_data.groupby(["Nom_carrer"])["Numero_expedient"].nunique().nlargest(1)
+    top_calle = load_top("Nom_carrer", selected_years, muertos, 1)
     # get the "Nom_carrer" with most accidents
-    top_calle = top_calle.reset_index()
-    # get the "Nom_carrer" with most accidents
-    calle = top_calle["Nom_carrer"].tolist()[0]
-    numero_acc = top_calle["Numero_expedient"].tolist()[0]
+    calle = top_calle["Nom_carrer"].iloc[0]
+    numero_acc = top_calle["count"].iloc[0]
     # show the "Nom_carrer" with most accidents
     col1.metric(label=f"Calle con más {texto} ({str(numero_acc)})", value=calle)
     # sacar metrica de año con mas accidentes
-    top_year = filtered_data.groupby(["NK_Any"])["Numero_expedient"].nunique().nlargest(1)
-    # sacar metrica de año con mas accidentes
-    top_year = top_year.reset_index()
+    top_year = totals_by_year.nlargest(1)
     # sacar metrica de año con mas accidentes
-    year = top_year["NK_Any"].tolist()[0]
-    numero_acc = top_year["Numero_expedient"].tolist()[0]
+    year = top_year.index[0]
+    numero_acc = top_year.iloc[0]
     # sacar metrica de año con mas accidentes
     col1.metric(label=f"Año con más {texto} ({str(numero_acc)})", value=year)
     # sacar metrica de año con menos accidentes
-    bottom_year = filtered_data.groupby(["NK_Any"])["Numero_expedient"].nunique().nsmallest(1)
-    # sacar metrica de año con menos accidentes
-    bottom_year = bottom_year.reset_index()
+    bottom_year = totals_by_year.nsmallest(1)
     # sacar metrica de año con menos accidentes
-    year = bottom_year["NK_Any"].tolist()[0]
-    numero_acc = bottom_year["Numero_expedient"].tolist()[0]
+    year = bottom_year.index[0]
+    numero_acc = bottom_year.iloc[0]
     # sacar metrica de año con menos accidentes
     col1.metric(label=f"Año con menos {texto} ({str(numero_acc)})", value=year)
 
@@ -1259,20 +1339,12 @@ def page_distritos_barrios():
     <small>Top 3 barrios ({})</small>
     """.format('-'.join(map(str, sorted(selected_years)))), unsafe_allow_html=True)
 
-    total_accidents_by_distrito = data.groupby("Nom_districte")["Numero_expedient"].nunique().reset_index(
-        name="Total_Accidents")
-
-    district_coordinates = filtered_data.groupby("Nom_districte").agg(
-        {"Latitud": "mean", "Longitud": "mean"}).reset_index()
-
-    # quitamos valores negativos o nulos en Latitud y Longitud
-    district_coordinates = district_coordinates[district_coordinates["Latitud"] > 0]
-    district_coordinates = district_coordinates[district_coordinates["Longitud"] > 0]
-
-    map_data = pd.merge(total_accidents_by_distrito, district_coordinates, on="Nom_districte", how="left")
-
-    # quitamos "Desconegut" de los datos
-    map_data = map_data[map_data["Nom_districte"] != "Desconegut"]
+    # los centroides de cada distrito vienen de la dimensión geográfica (ver geodim.py), que ya no tiene
+    # los desconocidos ni las coordenadas erróneas
+    geo = load_geo()
+    total_accidents_by_distrito = rollup(cube, ["Nom_districte"]).rename(columns={"Accidentes": "Total_Accidents"})
+    map_data = geo["Nom_districte"].merge(total_accidents_by_distrito.astype({"Nom_districte": str}),
+                                          on="Nom_districte")
 
     color_scale = [
         [0, "green"],
@@ -1306,14 +1378,10 @@ def page_distritos_barrios():
     st.plotly_chart(fig, use_container_width=True)
 
     # hacer un mapa ahora por barrios
-    total_accidents_by_barrio = data.groupby("Nom_barri")["Numero_expedient"].nunique().reset_index(
-        name="Total_Accidents")
-
-    barrio_coordinates = filtered_data.groupby("Nom_barri").agg(
-        {"Latitud": "mean", "Longitud": "mean"}).reset_index()
-    map_data = pd.merge(total_accidents_by_barrio, barrio_coordinates, on="Nom_barri", how="left")
-    # quitamos "Desconegut" de los datos
-    map_data = map_data[map_data["Nom_barri"] != "Desconegut"]
+    total_accidents_by_barrio = rollup(cube, ["Nom_districte", "Nom_barri"]).rename(
+        columns={"Accidentes": "Total_Accidents"})
+    map_data = geo["Nom_barri"].merge(
+        total_accidents_by_barrio.astype({"Nom_districte": str, "Nom_barri": str}), on=["Nom_districte", "Nom_barri"])
 
     fig = px.scatter_mapbox(
         map_data,
@@ -1342,16 +1410,13 @@ def page_distritos_barrios():
 
 def page_momento_accidente():
     st.title("Distribución accidentes en el tiempo (I)")
-    # Cargar datos
-    data = load_data()
-
-    # filtrar por numero expediente
-    data2 = data.groupby(["Numero_expedient"]).first().reset_index()
+    # Cargar datos (una fila por expediente)
+    bitmaps = load_accidents_bitmaps()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data2["NK_Any"].unique())
+    available_years = index_values(bitmaps, "NK_Any")
 
-    available_months = sorted(data2["Mes_any"].unique())
+    available_months = index_values(bitmaps, "Mes_any")
 
     # Checkbox para seleccionar los años
     selected_years = st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years)
@@ -1363,36 +1428,33 @@ def page_momento_accidente():
     ultimo_mes = selected_months[1]
     lista_meses_seleccionados = list(range(primer_mes, ultimo_mes + 1))
 
-    data2 = data2[data2["NK_Any"].isin(selected_years)]
-
-    data2 = data2[data2["Mes_any"].isin(lista_meses_seleccionados)]
-
-    # Filtrar los datos según sea necesario
-    filtered_data = data2[(data2["Descripcio_dia_setmana"].notnull()) & (data2["Hora_dia"].notnull())]
-
-    # Crear un histograma de horas del día
-    fig_horas_dia = px.histogram(
-        filtered_data,
-        x="Hora_dia",
-        nbins=24,  # Puedes ajustar el número de bins según tus necesidades
+    # Los gráficos reciben los recuentos calculados en el servidor, no las filas:
+    # histogramas con bincount (ver binning.py) y recuentos de turno y día de la semana (ver kpi.py),
+    # calculados por año y sumados para los años seleccionados
+    partials = load_moment_partials(selected_years, lista_meses_seleccionados)
+    counts = merge_summaries([partial["kpis"] for partial in partials], MOMENT_COUNTS)["counts"]
+
+    # Crear un histograma de horas del día (una barra por hora)
+    fig_horas_dia = px.bar(
+        merge_histograms([partial["horas"] for partial in partials]),
+        x="x",
+        y="count",
         title="Distribución de Accidentes por Horas del Día",
-        labels={"Hora_dia": "Hora del Día", "count": "Frecuencia"},
-        category_orders={"Hora_dia": sorted(filtered_data["Hora_dia"].unique())},  # Ordenar las horas del día
+        labels={"x": "Hora del Día", "count": "Frecuencia"},
     )
 
     # Actualizar el diseño del gráfico
     fig_horas_dia.update_layout(
         xaxis_title="Hora del Día",
         yaxis_title="Número de Accidentes",
+        bargap=0,
     )
 
-    # Filtrar los datos según sea necesario
-    filtered_data = data2[data2["Descripcio_torn"].notnull()]
-
     # Crear un gráfico de barras para el día de la semana
     fig_torn = px.bar(
-        filtered_data,
+        counts["Descripcio_torn"].reset_index(),
         x="Descripcio_torn",
+        y="count",
         title="Frecuencia de Accidentes por Turno",
         labels={"Descripcio_torn": "Turno", "count": "Frecuencia"},
         category_orders={"Descripcio_torn": ["Matí", "Tarda", "Nit"]},  # Ordenar los turnos
@@ -1404,34 +1466,27 @@ def page_momento_accidente():
         yaxis_title="Número de Accidentes",
     )
 
-    # Filtrar los datos según sea necesario
-    # -------------------------------------
-    filtered_data = data2[(data2["Dia_mes"].notnull()) & (data2["Dia_mes"].notnull())]
-
-    # Crear un histograma de horas del día
-    fig_dia_mes = px.histogram(
-        filtered_data,
-        x="Dia_mes",
-        nbins=31,  # Puedes ajustar el número de bins según tus necesidades
+    # Crear un histograma de días del mes (una barra por día, los días nulos no cuentan)
+    fig_dia_mes = px.bar(
+        merge_histograms([partial["dias"] for partial in partials]),
+        x="x",
+        y="count",
         title="Distribución de Accidentes por Día del mes",
-        labels={"Dia_mes": "Día del mes", "count": "Frecuencia"},
-        category_orders={"Dia_mes": sorted(filtered_data["Dia_mes"].unique())},  # Ordenar las horas del día
+        labels={"x": "Día del mes", "count": "Frecuencia"},
     )
 
     # Actualizar el diseño del gráfico
     fig_dia_mes.update_layout(
         xaxis_title="Día del mes",
         yaxis_title="Número de Accidentes",
+        bargap=0,
     )
 
-    # Filtrar los datos según sea necesario
-    # -------------------------------------
-    filtered_data = data2[data2["Descripcio_dia_setmana"].notnull()]
-
     # Crear un gráfico de barras para el día de la semana
     fig_dia_semana = px.bar(
-        filtered_data,
+        counts["Descripcio_dia_setmana"].reset_index(),
         x="Descripcio_dia_setmana",
+        y="count",
         title="Frecuencia de Accidentes por Día de la Semana",
         labels={"Descripcio_dia_setmana": "Día de la Semana", "count": "Frecuencia"},
         category_orders={"Descripcio_dia_setmana": ["Dilluns", "Dimarts", "Dimecres", "Dijous", "Divendres", "Dissabte",
@@ -1454,16 +1509,13 @@ def page_momento_accidente():
 
 def page_momento_accidente2():
     st.title("Distribución accidentes en el tiempo (II)")
-    # Cargar datos
-    data = load_data()
-
-    # filtrar por numero expediente
-    data2 = data.groupby(["Numero_expedient"]).first().reset_index()
+    # Cargar el cubo de recuentos de accidentes
+    cube = load_accidents_cube()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data2["NK_Any"].unique())
+    available_years = sorted(rollup(cube, ["NK_Any"])["NK_Any"])
 
-    available_months = sorted(data2["Mes_any"].unique())
+    available_months = sorted(rollup(cube, ["Mes_any"])["Mes_any"])
 
     # Checkbox para seleccionar los años
     selected_years = st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years)
@@ -1475,23 +1527,26 @@ def page_momento_accidente2():
     ultimo_mes = selected_months[1]
     lista_meses_seleccionados = list(range(primer_mes, ultimo_mes + 1))
 
-    data2 = data2[data2["NK_Any"].isin(selected_years)]
+    where = {"NK_Any": selected_years, "Mes_any": lista_meses_seleccionados}
 
-    data2 = data2[data2["Mes_any"].isin(lista_meses_seleccionados)]
+    # Los tres mapas de calor salen del mismo corte del cubo (año, mes, hora y día de la semana) con el
+    # kernel de tablas cruzadas sobre dimensiones codificadas (ver crosstab.py); las etiquetas de los
+    # días y los meses solo se ponen al representar
+    cells = slice_cube(cube, where, ["Hora_dia", "Descripcio_dia_setmana"])
 
-    # Filtrar los datos según sea necesario
-    filtered_data = data2[data2["Descripcio_dia_setmana"].notnull()]
+    # Recuentos por hora y día de la semana (sin los días nulos)
+    table = crosstab(cells, "Hora_dia", "Descripcio_dia_setmana", weights="Accidentes")
+    filtered_data = to_long(table)
 
     # Crear un mapa de calor para Día-Hora
     fig_heatmap = px.scatter(
-        filtered_data.groupby(["Hora_dia", "Descripcio_dia_setmana"]).size().reset_index(name="count"),
+        filtered_data,
         x="Hora_dia",
         y="Descripcio_dia_setmana",
         size="count",
         labels={"Hora_dia": "Hora del Día", "Descripcio_dia_setmana": "Día de la Semana", "count": "Frecuencia"},
         title="Mapa de Calor Día-Hora de Accidentes",
-        category_orders={"Descripcio_dia_setmana": ["Dilluns", "Dimarts", "Dimecres", "Dijous", "Divendres", "Dissabte",
-                                                    "Diumenge"]},  # Ordenar los días de la semana
+        category_orders={"Descripcio_dia_setmana": labels(table, "columns")},  # Ordenar los días de la semana
         color="count",  # Usa el tamaño para representar la frecuencia
         color_continuous_scale="Viridis",  # Puedes ajustar la escala de colores según tus preferencias
     )
@@ -1505,21 +1560,19 @@ def page_momento_accidente2():
     # Mostrar el mapa de calor
     st.plotly_chart(fig_heatmap, use_container_width=True)
 
-    # Filtrar los datos según sea necesario
-    filtered_data = data2[data2["Descripcio_dia_setmana"].notnull()]
+    # Recuentos por mes y día de la semana (sin los días nulos)
+    table = crosstab(cells, "Mes_any", "Descripcio_dia_setmana", weights="Accidentes")
+    filtered_data = to_long(table, row_name="Nom_mes")
 
     # Crear un mapa de calor para Día-Mes
     fig_heatmap_month = px.scatter(
-        filtered_data.groupby(["Nom_mes", "Descripcio_dia_setmana"]).size().reset_index(name="count"),
+        filtered_data,
         x="Nom_mes",
         y="Descripcio_dia_setmana",
         size="count",
         labels={"Nom_mes": "Mes", "Descripcio_dia_setmana": "Día de la Semana", "count": "Frecuencia"},
         title="Mapa de Calor Día-Mes de Accidentes",
-        category_orders={"Descripcio_dia_setmana": ["Dilluns", "Dimarts", "Dimecres", "Dijous", "Divendres", "Dissabte",
-                                                    "Diumenge"],
-                         "Nom_mes": ["Gener", "Febrer", "Març", "Abril", "Maig", "Juny", "Juliol", "Agost", "Setembre",
-                                     "Octubre", "Novembre", "Desembre"]},
+        category_orders={"Descripcio_dia_setmana": labels(table, "columns"), "Nom_mes": labels(table, "rows")},
         color="count",  # Usa el tamaño para representar la frecuencia
         color_continuous_scale="Viridis",  # Puedes ajustar la escala de colores según tus preferencias
     )
@@ -1534,9 +1587,9 @@ def page_momento_accidente2():
     st.plotly_chart(fig_heatmap_month, use_container_width=True)
 
     # Mapa de calor del mes en función del año
-    # Filtrar los datos según sea necesario
-    filtered_data = data2[data2["Nom_mes"].notnull()]
-    filtered_data = filtered_data.groupby(["NK_Any", "Nom_mes"]).size().reset_index(name="count")
+    # Recuentos por año y mes (sin los meses nulos)
+    table = crosstab(cells, "NK_Any", "Mes_any", weights="Accidentes")
+    filtered_data = to_long(table, column_name="Nom_mes")
     filtered_data["NK_Any"] = filtered_data["NK_Any"].astype(str)
 
     # Crear un mapa de calor para Día-Mes
@@ -1547,8 +1600,7 @@ def page_momento_accidente2():
         size="count",
         labels={"Nom_mes": "Mes", "NK_Any": "Año", "count": "Frecuencia"},
         title="Mapa de Calor Mes-Año de Accidentes",
-        category_orders={"Nom_mes": ["Gener", "Febrer", "Març", "Abril", "Maig", "Juny", "Juliol", "Agost", "Setembre",
-                                     "Octubre", "Novembre", "Desembre"]},  # Ordenar los días de la semana
+        category_orders={"Nom_mes": labels(table, "columns")},  # Ordenar los meses
         color="count",  # Usa el tamaño para representar la frecuencia
         color_continuous_scale="Viridis",  # Puedes ajustar la escala de colores según tus preferencias
     )
@@ -1566,11 +1618,11 @@ def page_momento_accidente2():
 def page_victimizacion():
     # titulo
     st.title("Victimización de los accidentes")
-    # Cargar datos
-    data = load_data()
+    # Cargar el cubo de recuentos
+    cube = load_cube()
 
     # Obtener la lista única de años en los datos
-    available_years = sorted(data["NK_Any"].unique())
+    available_years = sorted(rollup(cube, ["NK_Any"])["NK_Any"])
 
     # Checkbox para seleccionar los años
     selected_years = st.sidebar.multiselect("Seleccionar Años", available_years, default=available_years)
@@ -1578,14 +1630,15 @@ def page_victimizacion():
     # Radio para seleccionar entre porcentaje y valor real
     show_percentage = st.sidebar.radio("Mostrar en:", ["Porcentaje", "Valor Real"]) == "Porcentaje"
 
+    # Reparto por año y victimización en los años seleccionados
+    dist = distribution(cube, "Descripcio_victimitzacio_es", {"NK_Any": selected_years})
+
     # Crear pie chart
-    fig_pie, pie_chart_colors, category_order_pie_chart = create_victimizacion_pie_chart(data, sorted(selected_years),
-                                                                                    show_percentage)
+    fig_pie = create_distribution_pie_chart(dist, sorted(selected_years), show_percentage)
 
     if len(selected_years) > 1:
         # Crear gráfica de líneas
-        fig_line = create_victimizacion_line_chart(data, sorted(selected_years), pie_chart_colors, category_order_pie_chart,
-                                              show_percentage)
+        fig_line = create_distribution_line_chart(dist, sorted(selected_years), show_percentage)
         # Colocar las dos gráficas una al lado de la otra
         col1, col2 = st.columns(2)
 
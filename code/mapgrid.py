@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+
+# Agregación de los puntos del mapa en celdas cuadradas a varias resoluciones (una por nivel de zoom).
+# Las coordenadas se proyectan a metros alrededor del centro de Barcelona y, al construir la rejilla,
+# cada fila recibe el identificador de su celda en cada nivel. Una consulta solo hace un bincount de las
+# filas seleccionadas: el mapa recibe una marca por celda con el total de la celda (los totales se
+# conservan) situada en la posición media de sus puntos
+
+# Centro del mapa (origen de la proyección)
+CENTER = {"lat": 41.3851, "lon": 2.1734}
+
+# Metros por grado de latitud y de longitud en el centro del mapa
+METERS_PER_DEGREE_LAT = 110540.0
+METERS_PER_DEGREE_LON = 111320.0 * np.cos(np.radians(CENTER["lat"]))
+
+# Niveles de zoom con rejilla y tamaño de las celdas en píxeles de pantalla
+ZOOM_LEVELS = [10, 11, 12, 13, 14, 15, 16]
+CELL_PIXELS = 8
+
+
+def to_meters(lat, lon):
+    # Proyección equirectangular alrededor del centro del mapa (x hacia el este, y hacia el norte)
+    x = (np.asarray(lon, dtype=np.float64) - CENTER["lon"]) * METERS_PER_DEGREE_LON
+    y = (np.asarray(lat, dtype=np.float64) - CENTER["lat"]) * METERS_PER_DEGREE_LAT
+    return x, y
+
+
+def to_degrees(x, y):
+    return (CENTER["lat"] + np.asarray(y) / METERS_PER_DEGREE_LAT,
+            CENTER["lon"] + np.asarray(x) / METERS_PER_DEGREE_LON)
+
+
+def meters_per_pixel(zoom, lat=CENTER["lat"]):
+    # metros por píxel del mapa (teselas de 512 píxeles) a este nivel de zoom y latitud
+    return 78271.517 * np.cos(np.radians(lat)) / 2 ** zoom
+
+
+def cell_keys(ix, iy):
+    # clave entera única de la celda (ix, iy) de una rejilla: ix en los 32 bits altos e iy en los bajos
+    return (ix << 32) + (iy & 0xFFFFFFFF)
+
+
+def cell_size(zoom, pixels=CELL_PIXELS):
+    # metros que ocupan "pixels" píxeles en el mapa a este nivel de zoom
+    return pixels * meters_per_pixel(zoom)
+
+
+def _cell_ids(x, y, size):
+    # identificador denso de la celda de cada punto (-1 sin coordenadas)
+    valid = np.isfinite(x) & np.isfinite(y)
+    ix = np.floor(x[valid] / size).astype(np.int64)
+    iy = np.floor(y[valid] / size).astype(np.int64)
+    ids = np.full(len(x), -1, dtype=np.int64)
+    ids[valid], cells = pd.factorize(cell_keys(ix, iy))
+    return ids, len(cells)
+
+
+def build_grid(data, zooms=ZOOM_LEVELS):
+    # Rejilla de las filas de "data" (columnas "Latitud" y "Longitud"):
+    # {"lat", "lon", "levels": {zoom: {"size": metros, "ids": celda de cada fila, "cells": número de celdas}}}
+    lat = data["Latitud"].to_numpy(dtype=np.float64, na_value=np.nan)
+    lon = data["Longitud"].to_numpy(dtype=np.float64, na_value=np.nan)
+    x, y = to_meters(lat, lon)
+    grid = {"lat": lat, "lon": lon, "levels": {}}
+    for zoom in zooms:
+        size = cell_size(zoom)
+        ids, cells = _cell_ids(x, y, size)
+        grid["levels"][zoom] = {"size": size, "ids": ids, "cells": cells}
+    return grid
+
+
+def nearest_level(grid, zoom):
+    # nivel de la rejilla más cercano al zoom pedido
+    return min(grid["levels"], key=lambda level: abs(level - zoom))
+
+
+def aggregate(grid, zoom, mask=None, name="count"):
+    # Celdas del nivel de zoom con alguna fila seleccionada por "mask": DataFrame con "Latitud" y "Longitud"
+    # (posición media de los puntos de la celda) y "name" (filas de la celda)
+    level = grid["levels"][nearest_level(grid, zoom)]
+    ids = level["ids"] if mask is None else level["ids"][mask]
+    lat = grid["lat"] if mask is None else grid["lat"][mask]
+    lon = grid["lon"] if mask is None else grid["lon"][mask]
+    valid = ids >= 0
+    ids, lat, lon = ids[valid], lat[valid], lon[valid]
+
+    counts = np.bincount(ids, minlength=level["cells"])
+    occupied = counts > 0
+    return pd.DataFrame({
+        "Latitud": np.bincount(ids, weights=lat, minlength=level["cells"])[occupied] / counts[occupied],
+        "Longitud": np.bincount(ids, weights=lon, minlength=level["cells"])[occupied] / counts[occupied],
+        name: counts[occupied],
+    })
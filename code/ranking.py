@@ -0,0 +1,121 @@
+import json
+import os
+
+import pandas as pd
+
+# Índice de rankings de accidentes por año (calles, distritos y barrios), para todos los accidentes y solo
+# para los que tienen algún fallecido. Se genera en la ingesta junto a cada partición.
+# De cada año se guardan los RANKING_SIZE valores con más accidentes y la cota del resto (recuento del
+# siguiente valor): al sumar varios años, un valor que no está en la lista de un año tiene como mucho
+# esa cota. El top-N de una selección de años es exacto si los candidatos tienen todos sus recuentos y
+# ningún otro valor puede alcanzarlos; si no, top_n devuelve None y hay que contar sobre las filas
+
+# Rankings: nombre -> columnas que identifican cada valor (los barrios, junto con su distrito)
+RANKINGS = {
+    "Nom_carrer": ["Nom_carrer"],
+    "Nom_districte": ["Nom_districte"],
+    "Nom_barri": ["Nom_districte", "Nom_barri"],
+}
+
+RANKING_SIZE = 50
+
+# Carpeta del índice dentro del conjunto de datos (un fichero por año)
+RANKINGS_DIR = "_rankings"
+
+
+def rankings_dir(dataset_dir):
+    return os.path.join(dataset_dir, RANKINGS_DIR)
+
+
+def ranking_path(dataset_dir, year):
+    return os.path.join(rankings_dir(dataset_dir), f"NK_Any={year}.json")
+
+
+def rank_counts(counts, keys, n=None):
+    # Ordenar un recuento (columnas "keys" y "count") de más a menos y, en los empates, por los valores
+    counts = counts[counts["count"] > 0].astype({key: str for key in keys})
+    counts = counts.sort_values(["count"] + keys, ascending=[False] + [True] * len(keys), kind="stable")
+    return counts.reset_index(drop=True) if n is None else counts.head(n).reset_index(drop=True)
+
+
+def _ranking(accidents, keys, size):
+    counts = rank_counts(accidents.groupby(keys, observed=True).size().rename("count").reset_index(), keys)
+    return {"keys": counts[keys].head(size).to_numpy().tolist(),
+            "counts": counts["count"].head(size).tolist(),
+            "rest": int(counts["count"].iloc[size]) if len(counts) > size else 0}
+
+
+def build_rankings(accidents, size=RANKING_SIZE):
+    # Rankings de los accidentes de un año: {"all"/"fatal": {"total": accidentes, "rankings": {nombre:
+    # {"keys": valores, "counts": recuentos, "rest": cota del resto}}}}
+    rankings = {}
+    for flag, selection in (("all", accidents), ("fatal", accidents[accidents["Muertos"] > 0])):
+        rankings[flag] = {"total": len(selection),
+                          "rankings": {name: _ranking(selection, keys, size) for name, keys in RANKINGS.items()}}
+    return rankings
+
+
+def write_rankings(rankings, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf8") as f:
+        json.dump(rankings, f, ensure_ascii=False)
+
+
+def read_year_rankings(dataset_dir):
+    # Rankings de todos los años del conjunto de datos: {año: rankings}
+    directory = rankings_dir(dataset_dir)
+    if not os.path.isdir(directory):
+        return {}
+    rankings = {}
+    for name in sorted(os.listdir(directory)):
+        if name.startswith("NK_Any=") and name.endswith(".json"):
+            with open(os.path.join(directory, name), encoding="utf8") as f:
+                rankings[int(name[len("NK_Any="):-len(".json")])] = json.load(f)
+    return rankings
+
+
+def top_n(year_rankings, name, years, n, fatal=False):
+    # Los "n" valores con más accidentes en los años seleccionados (DataFrame con las columnas del ranking
+    # y "count"), o None si el índice no basta para asegurar el resultado
+    keys = RANKINGS[name]
+    flag = "fatal" if fatal else "all"
+    lower, known_rest, total_rest = {}, {}, 0
+    for year in years:
+        if year not in year_rankings:
+            continue
+        ranking = year_rankings[year][flag]["rankings"][name]
+        total_rest += ranking["rest"]
+        for key, count in zip(ranking["keys"], ranking["counts"]):
+            key = tuple(key)
+            lower[key] = lower.get(key, 0) + count
+            known_rest[key] = known_rest.get(key, 0) + ranking["rest"]
+    # cota superior de cada candidato: su recuento más la cota del resto de los años en los que no aparece
+    upper = {key: count + total_rest - known_rest[key] for key, count in lower.items()}
+
+    candidates = sorted(lower, key=lambda key: (-lower[key], key))
+    selected, others = candidates[:n], candidates[n:]
+    if any(upper[key] != lower[key] for key in selected):
+        return None
+    if len(selected) < n:
+        # hay menos candidatos que los pedidos: solo es exacto si no queda ningún valor fuera de las listas
+        threshold = 1
+    else:
+        threshold = lower[selected[-1]]
+    if total_rest >= threshold:
+        return None
+    for key in others:
+        # otro candidato solo puede empatar si su recuento es exacto y va detrás en el orden de los valores
+        if upper[key] > threshold or (upper[key] == threshold and (upper[key] != lower[key] or key < selected[-1])):
+            return None
+
+    result = pd.DataFrame(selected, columns=keys) if selected else pd.DataFrame(columns=keys)
+    result["count"] = [lower[key] for key in selected]
+    return result
+
+
+def year_totals(year_rankings, years, fatal=False):
+    # Accidentes de cada año seleccionado con datos (Series año -> "count")
+    flag = "fatal" if fatal else "all"
+    totals = {year: year_rankings[year][flag]["total"] for year in sorted(years) if year in year_rankings}
+    totals = pd.Series(totals, name="count", dtype="int64").rename_axis("NK_Any")
+    return totals[totals > 0]
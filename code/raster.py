@@ -0,0 +1,93 @@
+import base64
+import io
+
+import numpy as np
+from PIL import Image
+
+# Mapa de densidad dibujado en el servidor: los puntos seleccionados se acumulan con un bincount en una
+# imagen de tamaño fijo (un recuento por píxel) que se colorea en escala logarítmica y se envía al mapa
+# como una sola capa PNG. El coste en el navegador no depende del número de puntos. Con categorías (por
+# ejemplo la gravedad) el color de cada píxel mezcla los colores de las categorías según sus recuentos
+
+# Pantalla por píxel de la imagen (2: la imagen tiene la mitad de resolución que el mapa)
+SCREEN_PIXELS = 2
+
+# Escala de colores de la densidad (la misma que los mapas de marcas) y transparencia mínima de un píxel con datos
+COLOR_SCALE = [(0.0, (0, 128, 0)), (0.5, (255, 165, 0)), (1.0, (255, 0, 0))]
+MIN_ALPHA = 0.35
+
+# Colores de cada gravedad (valores de schema.SEVERITY; se buscan por nombre, no por posición)
+SEVERITY_COLORS = {
+    "Mortal": (200, 0, 0),
+    "Grave": (255, 140, 0),
+    "Leve": (30, 100, 220),
+    "Ileso": (0, 160, 0),
+}
+
+
+def _mercator(lat):
+    # coordenada y de la proyección de los mapas (Web Mercator), sin escalar
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+
+def raster_shape(pixels, margin=0.0, screen_pixels=SCREEN_PIXELS):
+    # (alto, ancho) de la imagen para un mapa de "pixels" (ancho, alto) más el margen alrededor
+    return (int(round(pixels[1] * (1 + 2 * margin) / screen_pixels)),
+            int(round(pixels[0] * (1 + 2 * margin) / screen_pixels)))
+
+
+def rasterize(lat, lon, bounds, shape, mask=None, categories=None, n_categories=1):
+    # Recuento de puntos por píxel de la zona "bounds" (lat_min, lat_max, lon_min, lon_max): matriz
+    # (categorías, alto, ancho). "categories" son los códigos de cada punto (-1 o nulos no se cuentan)
+    lat_min, lat_max, lon_min, lon_max = bounds
+    height, width = shape
+    if mask is not None:
+        lat, lon = lat[mask], lon[mask]
+        categories = None if categories is None else categories[mask]
+    if categories is None:
+        categories = np.zeros(len(lat), dtype=np.int64)
+
+    # fila 0 arriba (latitud máxima), como en la imagen
+    y_top, y_bottom = _mercator(lat_max), _mercator(lat_min)
+    with np.errstate(invalid="ignore"):
+        column = np.floor((lon - lon_min) / (lon_max - lon_min) * width)
+        row = np.floor((y_top - _mercator(lat)) / (y_top - y_bottom) * height)
+    valid = (column >= 0) & (column < width) & (row >= 0) & (row < height) & (categories >= 0)
+
+    pixels = (categories[valid].astype(np.int64) * height + row[valid].astype(np.int64)) * width + \
+        column[valid].astype(np.int64)
+    return np.bincount(pixels, minlength=n_categories * height * width).reshape(n_categories, height, width)
+
+
+def _scale_colors(intensity, scale):
+    positions = [position for position, _ in scale]
+    return np.stack([np.interp(intensity, positions, [color[channel] for _, color in scale])
+                     for channel in range(3)], axis=-1)
+
+
+def shade(counts, colors=None, scale=COLOR_SCALE, min_alpha=MIN_ALPHA):
+    # Imagen RGBA (uint8) de los recuentos. La intensidad es el logaritmo del total del píxel respecto al
+    # máximo; sin "colors" el color sale de la escala y con "colors" (uno por categoría) de la mezcla
+    total = counts.sum(axis=0)
+    intensity = np.log1p(total) / np.log1p(max(total.max(), 1))
+    if colors is None:
+        rgb = _scale_colors(intensity, scale)
+    else:
+        weights = counts / np.maximum(total, 1)
+        rgb = np.tensordot(weights, np.asarray(colors, dtype=np.float64), axes=([0], [0]))
+    alpha = np.where(total > 0, min_alpha + (1 - min_alpha) * intensity, 0) * 255
+    return np.dstack([rgb, alpha]).round().astype(np.uint8)
+
+
+def to_data_uri(image):
+    # PNG en base64 para usarlo como fuente de una capa del mapa
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG", optimize=False)
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def image_layer(source, bounds):
+    # Capa de imagen de plotly (layout.mapbox.layers) que cubre la zona "bounds"
+    lat_min, lat_max, lon_min, lon_max = bounds
+    return {"sourcetype": "image", "source": source, "below": "traces",
+            "coordinates": [[lon_min, lat_max], [lon_max, lat_max], [lon_max, lat_min], [lon_min, lat_min]]}
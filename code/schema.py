@@ -0,0 +1,214 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Esquema en memoria del conjunto de personas implicadas en accidentes:
+#   - categorías para las dimensiones de texto con pocos valores distintos
+#   - enteros pequeños para los campos de calendario y los códigos
+#   - entero con nulos para la edad y float32 para las coordenadas
+# Además se añaden las columnas con las categorías traducidas (ver LABELS), la gravedad (ver SEVERITY)
+# y la franja de edad (ver AGE_BINS)
+SCHEMA = {
+    "Numero_expedient": "string",
+    "Codi_districte": "int8",
+    "Nom_districte": "category",
+    "Codi_barri": "int8",
+    "Nom_barri": "category",
+    "Codi_carrer": "int32",
+    "Nom_carrer": "category",
+    "Num_postal": "category",
+    "Descripcio_dia_setmana": "category",
+    "Dia_setmana": "category",
+    "Descripcio_tipus_dia": "category",
+    "NK_Any": "int16",
+    "Mes_any": "int8",
+    "Nom_mes": "category",
+    "Dia_mes": "int8",
+    "Descripcio_torn": "category",
+    "Hora_dia": "int8",
+    "Descripcio_causa_vianant": "category",
+    "Desc_Tipus_vehicle_implicat": "category",
+    "Descripcio_sexe": "category",
+    "Edat": "Int16",
+    "Descripcio_tipus_persona": "category",
+    "Descripcio_situacio": "category",
+    "Descripcio_victimitzacio": "category",
+    "Coordenada_UTM_X": "float32",
+    "Coordenada_UTM_Y": "float32",
+    "Longitud": "float32",
+    "Latitud": "float32",
+}
+
+# Valores de "Edat" que significan edad desconocida
+UNKNOWN_AGES = ["Desconegut", "-1"]
+
+# Traducción al castellano de las categorías en catalán. Se guarda en una columna nueva
+# (columna original + LABEL_SUFFIX) para conservar también el código original.
+# El orden de los valores traducidos es el orden de las categorías
+LABELS = {
+    "Descripcio_sexe": {
+        "Home": "Hombre",
+        "Dona": "Mujer",
+        "Desconegut": "Desconocido",
+    },
+    "Descripcio_tipus_persona": {
+        "Conductor": "Conductor",
+        "Passatger": "Pasajero",
+        "Vianant": "Peatón",
+        "Desconegut": "Desconocido",
+    },
+    "Descripcio_victimitzacio": {
+        "Mort (dins 24h posteriors accident)": "Muerto",
+        "Mort (després de 24h posteriors accident)": "Muerto",
+        "Mort natural": "Muerto",
+        "Ferit greu: hospitalització superior a 24h": "Herido grave",
+        "Ferit lleu: Amb assistència sanitària en lloc d'accident": "Herido leve",
+        "Ferit lleu: Hospitalització fins a 24h": "Herido leve",
+        "Ferit lleu: Rebutja assistència sanitària": "Herido leve",
+        "Il.lès": "Sano",
+        "Desconegut": "Desconocido",
+        "Es desconeix": "Desconocido",
+    },
+}
+LABEL_SUFFIX = "_es"
+
+# Gravedad de cada persona a partir de la victimización traducida (los desconocidos quedan como nulos)
+# y marca booleana de fallecido, para filtrar sin recorrer los textos
+SEVERITY = {
+    "Muerto": "Mortal",
+    "Herido grave": "Grave",
+    "Herido leve": "Leve",
+    "Sano": "Ileso",
+}
+
+# Un fallecido es cualquier victimización original que empieza por "Mort", aunque no esté en LABELS.
+# Es la única definición: la usan la gravedad de las personas y los muertos de la tabla de accidentes
+FATAL_PREFIX = "Mort"
+
+# Franjas de edad (mismos cortes que la página de grupos de edad)
+AGE_BINS = [-1, 24, 50, 75, 140]
+AGE_LABELS = ["< 25", "25-50", "51-75", "> 75"]
+
+
+def _to_integer(series, dtype):
+    values = pd.to_numeric(series, errors="coerce")
+    # si hay nulos usamos el entero con nulos equivalente ("int8" -> "Int8")
+    if values.isna().any():
+        dtype = dtype.capitalize()
+    return values.astype(dtype)
+
+
+def apply_schema(data):
+    # Convertir el DataFrame cargado al esquema compacto y añadir las columnas derivadas
+    return add_derived_columns(convert_schema(data))
+
+
+def convert_schema(data):
+    # Convertir los tipos al esquema compacto (las columnas que no están en SCHEMA no se tocan)
+    data = data.copy()
+    for column, dtype in SCHEMA.items():
+        if column not in data.columns:
+            continue
+
+        if column == "Edat":
+            ages = data[column].astype("string").str.strip()
+            data[column] = _to_integer(ages.mask(ages.isin(UNKNOWN_AGES)), "int16").astype(dtype)
+        elif dtype.startswith("int"):
+            data[column] = _to_integer(data[column], dtype)
+        elif dtype.startswith("float"):
+            data[column] = pd.to_numeric(data[column], errors="coerce").astype(dtype)
+        else:
+            data[column] = data[column].astype(dtype)
+
+    return data
+
+
+def label_column(column):
+    return column + LABEL_SUFFIX
+
+
+def add_labels(data):
+    # Añadir las columnas traducidas (categorías) que falten. Sobre una columna de categorías
+    # la traducción se hace sobre las categorías y no fila a fila
+    for column, mapping in LABELS.items():
+        if column not in data.columns or label_column(column) in data.columns:
+            continue
+        categories = list(dict.fromkeys(mapping.values()))
+        # set_categories reordena los códigos (astype no lo hace si ya tiene las mismas categorías en otro orden)
+        data[label_column(column)] = data[column].astype("category").map(mapping).astype(
+            "category").cat.set_categories(categories)
+    return data
+
+
+def is_fatal(victimization):
+    # Máscara booleana de fallecidos a partir de "Descripcio_victimitzacio" (texto original).
+    # Con una categoría solo se miran sus categorías, no cada fila
+    if isinstance(victimization.dtype, pd.CategoricalDtype):
+        fatal = np.append(victimization.cat.categories.astype(str).str.startswith(FATAL_PREFIX), False)
+        return fatal[victimization.cat.codes.to_numpy()]
+    return victimization.astype("string").str.startswith(FATAL_PREFIX).fillna(False).to_numpy(dtype=bool)
+
+
+def add_severity(data):
+    # Añadir "Gravedad" (categoría ordenada de mortal a ileso) y "Muerto" (booleano).
+    # En la tabla de accidentes "Muerto" marca los accidentes con algún fallecido
+    if "Muerto" in data.columns:
+        return data
+    if "Descripcio_victimitzacio_es" in data.columns:
+        severity = data["Descripcio_victimitzacio_es"].map(SEVERITY).astype("object")
+        severity[is_fatal(data["Descripcio_victimitzacio"])] = "Mortal"
+        data["Gravedad"] = severity.astype(pd.CategoricalDtype(list(SEVERITY.values()), ordered=True))
+        data["Muerto"] = (data["Gravedad"] == "Mortal").to_numpy(dtype=bool)
+    elif "Muertos" in data.columns:
+        data["Muerto"] = (data["Muertos"] > 0).to_numpy(dtype=bool)
+    return data
+
+
+def add_age_band(data):
+    # Añadir "Franja_Edad" (categoría) a partir de la edad
+    if "Edat" not in data.columns or "Franja_Edad" in data.columns:
+        return data
+    data["Franja_Edad"] = pd.cut(data["Edat"].astype("float32"), bins=AGE_BINS, labels=AGE_LABELS)
+    return data
+
+
+def add_derived_columns(data):
+    # Columnas que se calculan una vez al cargar (o en la instantánea de la ingesta)
+    return add_age_band(add_severity(add_labels(data)))
+
+
+def memory_report(before, after):
+    # Memoria por columna (bytes) antes y después de aplicar el esquema
+    report = pd.DataFrame({
+        "dtype_antes": before.dtypes.astype(str),
+        "antes": before.memory_usage(index=False, deep=True),
+        "dtype_despues": after.dtypes.astype(str),
+        "despues": after.memory_usage(index=False, deep=True),
+    })
+    report.loc["Total"] = ["", report["antes"].sum(), "", report["despues"].sum()]
+    report["ratio"] = (report["antes"] / report["despues"]).round(2)
+    return report
+
+
+def main():
+    from ingest import normalize_columns
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Informe de memoria del esquema compacto")
+    parser.add_argument("path", nargs="?", default=os.path.join(here, "..", "data", "datos_combinados.csv"),
+                        help="csv combinado (separado por ';') o csv anual de Open Data BCN")
+    args = parser.parse_args()
+
+    with open(args.path, encoding="utf8") as f:
+        delimiter = ";" if f.readline().count(";") else ","
+    # cargamos igual que load_data con el csv: tipos inferidos por pandas
+    before = normalize_columns(pd.read_csv(args.path, encoding="utf8", delimiter=delimiter))
+    after = apply_schema(before)
+
+    print(memory_report(before, after).to_string())
+
+
+if __name__ == "__main__":
+    main()
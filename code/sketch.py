@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from kpi import INTRO_DISTINCT
+
+# Sketches de valores distintos por año, que se generan en la ingesta junto a cada partición.
+# Los de varios años se fusionan para obtener los valores distintos de cualquier selección de años
+# sin recorrer las filas:
+#   - "exact": conjunto de valores del año (fusión = unión, resultado exacto)
+#   - "hll": registros HyperLogLog de 2^precision bytes (fusión = máximo, error típico ~1.04/sqrt(2^precision))
+# Cada sketch guarda también el número de valores no nulos de la columna, que es aditivo
+
+# Columnas con sketch (las de valores distintos de la página de introducción)
+SKETCH_COLUMNS = INTRO_DISTINCT
+
+SKETCH_MODES = ["exact", "hll"]
+SKETCH_MODE = "exact"
+HLL_PRECISION = 12
+
+# Carpeta de los sketches dentro del conjunto de datos (un fichero por año)
+SKETCHES_DIR = "_sketches"
+
+
+def sketches_dir(dataset_dir):
+    return os.path.join(dataset_dir, SKETCHES_DIR)
+
+
+def sketch_path(dataset_dir, year):
+    return os.path.join(sketches_dir(dataset_dir), f"NK_Any={year}.npz")
+
+
+def _hll_registers(values, precision):
+    # los primeros "precision" bits del hash eligen el registro y los 32 siguientes dan el rango
+    # (posición del primer bit a 1), cada registro guarda el rango máximo
+    hashes = pd.util.hash_array(values.astype(object))
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    bits = ((hashes >> np.uint64(32 - precision)) & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    rank = np.where(bits > 0, 32 - np.floor(np.log2(np.maximum(bits, 1))), 33).astype(np.uint8)
+
+    registers = np.zeros(1 << precision, dtype=np.uint8)
+    np.maximum.at(registers, index, rank)
+    return registers
+
+
+def _hll_estimate(registers):
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int((registers == 0).sum())
+    # corrección para pocos valores (linear counting)
+    if estimate <= 2.5 * m and zeros > 0:
+        estimate = m * np.log(m / zeros)
+    return int(round(estimate))
+
+
+def build_sketches(data, columns=SKETCH_COLUMNS, mode=SKETCH_MODE, precision=HLL_PRECISION):
+    # Sketches de las columnas de una selección de filas (normalmente, un año):
+    # {"mode": modo, "precision": precisión, "columns": {columna: {"sketch": array, "count": no nulos}}}
+    sketches = {"mode": mode, "precision": precision, "columns": {}}
+    for column in columns:
+        values = data[column].dropna().astype(str).to_numpy(dtype=str)
+        if mode == "exact":
+            sketch = np.unique(values)
+        else:
+            sketch = _hll_registers(values, precision)
+        sketches["columns"][column] = {"sketch": sketch, "count": len(values)}
+    return sketches
+
+
+def merge_sketches(sketches):
+    # Fusionar los sketches de varios años (mismo modo y precisión). Sin sketches, el resultado está vacío
+    if not sketches:
+        return {"mode": SKETCH_MODE, "precision": HLL_PRECISION, "columns": {}}
+    first = sketches[0]
+    for year_sketches in sketches[1:]:
+        if (year_sketches["mode"], year_sketches["precision"]) != (first["mode"], first["precision"]):
+            raise ValueError(f"No se pueden fusionar sketches {first['mode']} (precisión {first['precision']}) y "
+                             f"{year_sketches['mode']} (precisión {year_sketches['precision']}): "
+                             "hay que regenerarlos con ingest.py")
+    merged = {"mode": first["mode"], "precision": first["precision"], "columns": {}}
+    for column in first["columns"]:
+        parts = [year_sketches["columns"][column] for year_sketches in sketches]
+        if first["mode"] == "exact":
+            sketch = np.unique(np.concatenate([part["sketch"] for part in parts]))
+        else:
+            sketch = np.maximum.reduce([part["sketch"] for part in parts])
+        merged["columns"][column] = {"sketch": sketch, "count": sum(part["count"] for part in parts)}
+    return merged
+
+
+def distinct_count(sketches, column):
+    # valores distintos de una columna (0 si no hay sketch)
+    if column not in sketches["columns"]:
+        return 0
+    sketch = sketches["columns"][column]["sketch"]
+    return len(sketch) if sketches["mode"] == "exact" else _hll_estimate(sketch)
+
+
+def non_null_count(sketches, column):
+    if column not in sketches["columns"]:
+        return 0
+    return sketches["columns"][column]["count"]
+
+
+def write_sketches(sketches, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {"mode": np.array(sketches["mode"]), "precision": np.array(sketches["precision"])}
+    for column, values in sketches["columns"].items():
+        arrays[column] = values["sketch"]
+        arrays[column + ".count"] = np.array(values["count"])
+    np.savez(path, **arrays)
+
+
+def read_sketches(path):
+    with np.load(path) as arrays:
+        sketches = {"mode": str(arrays["mode"]), "precision": int(arrays["precision"]), "columns": {}}
+        for key in arrays.files:
+            if key not in ("mode", "precision") and not key.endswith(".count"):
+                sketches["columns"][key] = {"sketch": arrays[key], "count": int(arrays[key + ".count"])}
+    return sketches
+
+
+def read_sketch_settings(path):
+    # (modo, precisión) de un fichero de sketches, sin cargar los sketches
+    with np.load(path) as arrays:
+        return str(arrays["mode"]), int(arrays["precision"])
+
+
+def read_year_sketches(dataset_dir):
+    # Sketches de todos los años del conjunto de datos: {año: sketches}
+    directory = sketches_dir(dataset_dir)
+    if not os.path.isdir(directory):
+        return {}
+    sketches = {}
+    for name in sorted(os.listdir(directory)):
+        if name.startswith("NK_Any=") and name.endswith(".npz"):
+            sketches[int(name[len("NK_Any="):-len(".npz")])] = read_sketches(os.path.join(directory, name))
+    return sketches
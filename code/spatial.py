@@ -0,0 +1,140 @@
+import numpy as np
+
+from mapgrid import (CENTER, METERS_PER_DEGREE_LAT, METERS_PER_DEGREE_LON, cell_keys, meters_per_pixel,
+                     to_meters)
+
+# Índice espacial de cubetas sobre las coordenadas (proyectadas a metros, ver mapgrid.py).
+# Las filas se ordenan por cubeta cuadrada de BUCKET_SIZE metros y para cada cubeta ocupada se guarda
+# dónde empiezan sus filas. Una consulta (rectángulo, radio o k vecinos más cercanos) solo mira las
+# cubetas que cortan la zona buscada, y se puede combinar con una máscara de filas (filtros de bitmap.py)
+
+BUCKET_SIZE = 100.0
+
+# Tamaño del mapa en píxeles para calcular la zona visible (ancho aproximado con use_container_width)
+VIEWPORT_PIXELS = (1400, 600)
+
+# Margen alrededor de la zona visible (fracción del tamaño del mapa) para poder desplazar el mapa un poco
+VIEWPORT_MARGIN = 0.5
+
+
+def build_index(data, size=BUCKET_SIZE):
+    # Índice de las filas de "data" (columnas "Latitud" y "Longitud"). Las filas sin coordenadas no se indexan
+    x, y = to_meters(data["Latitud"].to_numpy(dtype=np.float64, na_value=np.nan),
+                     data["Longitud"].to_numpy(dtype=np.float64, na_value=np.nan))
+    rows = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+    keys = cell_keys(np.floor(x[rows] / size).astype(np.int64), np.floor(y[rows] / size).astype(np.int64))
+
+    order = np.argsort(keys, kind="stable")
+    keys, rows = keys[order], rows[order]
+    buckets, starts = np.unique(keys, return_index=True)
+    return {"size": size, "rows": rows, "x": x[rows], "y": y[rows], "buckets": buckets,
+            "bucket_x": np.floor(x[rows[starts]] / size).astype(np.int64),
+            "bucket_y": np.floor(y[rows[starts]] / size).astype(np.int64),
+            "starts": np.append(starts, len(rows)), "length": len(data)}
+
+
+def _positions(index, x_min, x_max, y_min, y_max):
+    # posiciones (en el orden del índice) de las filas de las cubetas que cortan el rectángulo
+    size = index["size"]
+    buckets = index["buckets"]
+    if not len(buckets):
+        return np.empty(0, dtype=np.int64)
+
+    # el rectángulo se recorta a las cubetas ocupadas: un punto lejano no genera millones de claves
+    ix_min = max(np.floor(x_min / size), index["bucket_x"].min())
+    ix_max = min(np.floor(x_max / size), index["bucket_x"].max())
+    iy_min = max(np.floor(y_min / size), index["bucket_y"].min())
+    iy_max = min(np.floor(y_max / size), index["bucket_y"].max())
+    if ix_min > ix_max or iy_min > iy_max:
+        return np.empty(0, dtype=np.int64)
+
+    if (ix_max - ix_min + 1) * (iy_max - iy_min + 1) > len(buckets):
+        # más claves posibles que cubetas ocupadas: se filtran las ocupadas
+        found = np.flatnonzero((index["bucket_x"] >= ix_min) & (index["bucket_x"] <= ix_max) &
+                               (index["bucket_y"] >= iy_min) & (index["bucket_y"] <= iy_max))
+    else:
+        ix = np.arange(ix_min, ix_max + 1, dtype=np.int64)
+        iy = np.arange(iy_min, iy_max + 1, dtype=np.int64)
+        wanted = cell_keys(np.repeat(ix, len(iy)), np.tile(iy, len(ix)))
+        found = np.minimum(np.searchsorted(buckets, wanted), len(buckets) - 1)
+        found = found[buckets[found] == wanted]
+
+    # posiciones consecutivas de cada cubeta encontrada, sin recorrerlas una a una
+    begin = index["starts"][found]
+    lengths = index["starts"][found + 1] - begin
+    return np.repeat(begin - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+
+def _filter(index, positions, mask):
+    if mask is not None:
+        positions = positions[mask[index["rows"][positions]]]
+    return positions
+
+
+def bbox(index, lat_min, lat_max, lon_min, lon_max, mask=None):
+    # Filas (índices posicionales) dentro del rectángulo y seleccionadas por "mask"
+    x_min, y_min = to_meters(lat_min, lon_min)
+    x_max, y_max = to_meters(lat_max, lon_max)
+    positions = _filter(index, _positions(index, x_min, x_max, y_min, y_max), mask)
+    x, y = index["x"][positions], index["y"][positions]
+    inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+    return np.sort(index["rows"][positions[inside]])
+
+
+def radius(index, lat, lon, meters, mask=None):
+    # Filas a "meters" metros o menos del punto: (índices posicionales, distancias), de más cerca a más lejos
+    x, y = to_meters(lat, lon)
+    positions = _filter(index, _positions(index, x - meters, x + meters, y - meters, y + meters), mask)
+    distances = np.hypot(index["x"][positions] - x, index["y"][positions] - y)
+    inside = distances <= meters
+    order = np.argsort(distances[inside], kind="stable")
+    return index["rows"][positions[inside]][order], distances[inside][order]
+
+
+def _covers(index, x, y, reach):
+    # el cuadrado de lado 2 * reach alrededor del punto contiene todas las cubetas ocupadas
+    size = index["size"]
+    return (x - reach <= index["bucket_x"].min() * size and x + reach >= (index["bucket_x"].max() + 1) * size and
+            y - reach <= index["bucket_y"].min() * size and y + reach >= (index["bucket_y"].max() + 1) * size)
+
+
+def nearest(index, lat, lon, k, mask=None, groups=None):
+    # Las "k" filas más cercanas al punto: (índices posicionales, distancias). Se busca en anillos de
+    # cubetas cada vez mayores hasta que las k encontradas están más cerca que el borde buscado. Con
+    # "groups" (un código por fila, por ejemplo el expediente) se devuelve la fila más cercana de los k
+    # grupos más cercanos
+    x, y = to_meters(lat, lon)
+    reach = index["size"]
+    while True:
+        # cuando el cuadrado ya cubre todo el índice se miran todas las filas una sola vez
+        complete = _covers(index, x, y, reach)
+        if complete:
+            positions = _filter(index, np.arange(len(index["rows"])), mask)
+        else:
+            positions = _filter(index, _positions(index, x - reach, x + reach, y - reach, y + reach), mask)
+        distances = np.hypot(index["x"][positions] - x, index["y"][positions] - y)
+        order = np.argsort(distances, kind="stable")
+        if groups is not None:
+            # primera fila (la más cercana) de cada grupo, en orden de distancia
+            _, first = np.unique(groups[index["rows"][positions[order]]], return_index=True)
+            order = order[np.sort(first)]
+        order = order[:k]
+        enough = len(order) == k and (k == 0 or distances[order[-1]] <= reach)
+        if enough or complete:
+            return index["rows"][positions[order]], distances[order]
+        reach *= 2
+
+
+def viewport(zoom, center=CENTER, pixels=VIEWPORT_PIXELS, margin=VIEWPORT_MARGIN):
+    # Rectángulo visible del mapa (lat_min, lat_max, lon_min, lon_max) con este zoom y centro, más el margen
+    meters = meters_per_pixel(zoom, center["lat"]) * (1 + 2 * margin)
+    half_width, half_height = pixels[0] / 2 * meters, pixels[1] / 2 * meters
+    return (center["lat"] - half_height / METERS_PER_DEGREE_LAT, center["lat"] + half_height / METERS_PER_DEGREE_LAT,
+            center["lon"] - half_width / METERS_PER_DEGREE_LON, center["lon"] + half_width / METERS_PER_DEGREE_LON)
+
+
+def viewport_mask(index, zoom, center=CENTER, mask=None):
+    # Máscara de las filas visibles en el mapa (y seleccionadas por "mask")
+    visible = np.zeros(index["length"], dtype=bool)
+    visible[bbox(index, *viewport(zoom, center), mask=mask)] = True
+    return visible
@@ -0,0 +1,30 @@
+import glob
+import os
+
+import pytest
+
+from backend import PARITY_QUERIES, _equal, _normalize, connect_duckdb, load_pandas
+from ingest import update_dataset
+
+# Paridad de los backends de consultas: cada consulta de PARITY_QUERIES tiene que devolver lo mismo con
+# pandas y con duckdb sobre un conjunto de datos generado con la ingesta a partir de los csv de "data"
+
+pytest.importorskip("duckdb")
+
+RAW_FILES = sorted(glob.glob(os.path.join(os.path.dirname(__file__), "..", "data", "2018_*.csv")))
+
+
+@pytest.fixture(scope="module")
+def conns(tmp_path_factory):
+    if not RAW_FILES:
+        pytest.skip("no hay ficheros anuales en data")
+    dataset_dir = str(tmp_path_factory.mktemp("datos_combinados"))
+    update_dataset(RAW_FILES, dataset_dir, workers=1)
+    return {"pandas": load_pandas(dataset_dir), "duckdb": connect_duckdb(dataset_dir)}
+
+
+@pytest.mark.parametrize("name, function, kwargs", PARITY_QUERIES, ids=[name for name, _, _ in PARITY_QUERIES])
+def test_parity(conns, name, function, kwargs):
+    expected = _normalize(function(conns["pandas"], **kwargs))
+    result = _normalize(function(conns["duckdb"], **kwargs))
+    assert _equal(expected, result), name